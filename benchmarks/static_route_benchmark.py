@@ -0,0 +1,71 @@
+"""
+Compare the exact path table with werkzeug matching as the route table grows.
+
+    python benchmarks/static_route_benchmark.py
+"""
+import timeit
+
+from werkzeug.routing import Map
+from werkzeug.test import EnvironBuilder
+
+from rocinante import Rocinante, Request
+
+ROUTE_COUNTS = [10, 100, 1000, 10000]
+
+# werkzeug matching is linear in the number of rules, scale iterations down as the table grows
+ITERATION_BUDGET = 200000
+
+
+def build_app(route_count: int):
+    # every benchmark app owns its url map, Rocinante.url_map is shared by default
+    class BenchmarkApp(Rocinante):
+        url_map = Map()
+
+    app = BenchmarkApp(__name__)
+
+    for index in range(route_count):
+        app.route(f'/api/resource{index}')(view)
+        app.route(f'/api/resource{index}/<item_id>')(view)
+
+    return app
+
+
+def view(request: Request):
+    return 'ok'
+
+
+def bench(app, path: str):
+    environ = EnvironBuilder(path=path).get_environ()
+    request = app.request_class(environ)
+
+    def with_static_table():
+        app._match_rule(request, environ)
+
+    def without_static_table():
+        app.url_map.bind_to_environ(environ).match(return_rule=True)
+
+    number = max(10, ITERATION_BUDGET // len(app._static_rules))
+
+    static_time = min(timeit.repeat(with_static_table, number=number, repeat=3))
+    werkzeug_time = min(timeit.repeat(without_static_table, number=number, repeat=3))
+
+    return static_time / number * 1e6, werkzeug_time / number * 1e6
+
+
+def main():
+    print(f'{"rules":>8} {"path":<28} {"static table (us)":>18} {"werkzeug (us)":>14} {"speedup":>8}')
+
+    for route_count in ROUTE_COUNTS:
+        app = build_app(route_count)
+        last = route_count - 1
+
+        for path in [f'/api/resource{last}', f'/api/resource{last}/42']:
+            static_us, werkzeug_us = bench(app, path)
+            print(
+                f'{route_count * 2:>8} {path:<28} {static_us:>18.2f} {werkzeug_us:>14.2f} '
+                f'{werkzeug_us / static_us:>7.1f}x'
+            )
+
+
+if __name__ == '__main__':
+    main()
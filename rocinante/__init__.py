@@ -1,11 +1,12 @@
 from werkzeug.wrappers import Response
 
 from .application import Rocinante
-from .request import Request
-from .response import JSONResponse, Render
+from .request import Request, UploadLimits
+from .response import JSONResponse, StreamingJSONResponse, Render
 from .router import Router
 from .handler import RequestHandler
 from .url import Url
+from .codec import JSONCodec
 from . import status
 from .request_arguments_types import RequestHeaders, RequestCookies, RequestForm, RequestFiles, RequestArgs, \
-    RequestJSON, RequestBody
+    RequestJSON, RequestBody, RequestStream
@@ -1,28 +1,39 @@
-import json
+import hashlib
 import os
 from typing import Type
-from inspect import isfunction
-from typing import Callable
+from inspect import isfunction, iscoroutine
+from types import GeneratorType
+from operator import attrgetter
+from typing import Callable, List, Union
 from collections import Iterable, OrderedDict
 
 from werkzeug import run_simple, Response
-from werkzeug.exceptions import NotFound
+from werkzeug.exceptions import HTTPException, NotFound
 from werkzeug.routing import Map, Rule
 from werkzeug.wsgi import ClosingIterator
 from geventwebsocket.resource import WebSocketApplication
+from gevent.pool import Pool
 from gevent.pywsgi import WSGIServer
 from geventwebsocket.handler import WebSocketHandler as GeventWebSocketHandler
 from a2wsgi import ASGIMiddleware
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, TemplateError
 
-from .request import Request
-from .response import Render
+from .request import Request, UploadLimits
+from .response import Render, StreamingJSONResponse as _StreamingJSONResponse
 from .config import Config
-from .cache import HandlerLRUCache
+from .cache import HandlerLRUCache, StaticFileCache
+from .codec import JSONCodec, default_json_codec
+from .mount import MountedAppTrie
+from .server import PreforkServer, AdmissionControl
+from .asgi import ASGIHandler
 from .websocket import WebsocketResource
 from .request_arguments_types import SUPPORT_ARGUMENTS_MAPPING
 
 
+def _get_request(request):
+    return request
+
+
 class Rocinante(object):
     http_method_names = ['get', 'post', 'put', 'patch', 'delete', 'head', 'options', 'trace']
 
@@ -32,12 +43,10 @@ class Rocinante(object):
 
     _config = Config
 
-    _mounted_wsgi_apps = {}
-
-    _cache = HandlerLRUCache()
-
     static_file_handlers = {}
 
+    static_file_options = {}
+
     _websocket_resource = WebsocketResource()
 
     websocket_apps = OrderedDict()
@@ -52,14 +61,41 @@ class Rocinante(object):
             json_response_class: Type[Response] = None,
             not_found_response_class: Type[Response] = None,
             method_not_allowed_response_class: [Response] = None,
-            handler_cache_capacity: int = 128
+            handler_cache_capacity: int = 128,
+            negative_cache_capacity: int = 256,
+            json_codec: JSONCodec = None,
+            json_max_size: int = None,
+            template_bytecode_cache_dir: str = None,
+            template_auto_reload: bool = True,
+            precompile_templates: Union[str, List[str]] = None,
+            asgi_thread_pool_size: int = None
     ):
         """
         accept subclass of Rocinante.Request or subclass of werkzeug.Response
+        json_codec encodes json responses and decodes Request.json, the stdlib json module is used by default
+        json_max_size rejects json bodies larger than this many bytes with 413, None means no limit
+        template_bytecode_cache_dir keeps compiled templates on disk, so restarted workers skip compiling them
+        template_auto_reload checks templates for changes on every render, run(debug=False) turns it off
+        precompile_templates compiles the templates in these directories under the loader root, e.g. 'templates',
+        now instead of on first render
+        asgi_thread_pool_size is the number of threads running sync views when the app is served by asgi_app
         """
 
+        if template_bytecode_cache_dir is not None:
+            os.makedirs(template_bytecode_cache_dir, exist_ok=True)
+
         file_loader = self._get_file_loader(import_name)
-        self.template_environment = Environment(loader=file_loader)
+        self.template_environment = Environment(
+            loader=file_loader,
+            auto_reload=template_auto_reload,
+            bytecode_cache=FileSystemBytecodeCache(
+                template_bytecode_cache_dir
+            ) if template_bytecode_cache_dir is not None else None
+        )
+        self.template_environment.globals['static_url'] = self.static_url
+
+        if precompile_templates:
+            self.compile_templates(precompile_templates)
 
         # make sure request class and response class is correct
         self._check_request_class(request_class)
@@ -76,13 +112,43 @@ class Rocinante(object):
 
         self.request_class = request_class
         self.response_class = response_class
+        self.json_codec = json_codec if json_codec is not None else default_json_codec
+        self.json_max_size = json_max_size
+
+        # request class bound to the json settings of this application
+        self._request_class = self._generate_request_class()
         self.handler_cache_capacity = handler_cache_capacity
 
+        # request arguments injection plans keyed by (view, path argument names), compiled when the views are registered,
+        # a view registered on several rules gets a plan per rule
+        self._request_arguments_plans = {}
+
+        # exact path to rule table of rules without converters, checked before werkzeug matching
+        self._static_rules = {}
+
+        # events run in every prefork worker after it is forked
+        self._worker_startup_events = []
+
+        # mounted wsgi/asgi apps indexed by path segments, checked before route matching
+        self._mounted_wsgi_apps = MountedAppTrie()
+
+        # wrapped asgi app to the original one, asgi_app calls the original without a2wsgi
+        self._mounted_asgi_apps = {}
+
+        self._asgi_handler = ASGIHandler(self, asgi_thread_pool_size)
+        self.negative_cache_capacity = negative_cache_capacity
+
+        # dispatch caches keyed by (method, host, path), 404/405 results are kept apart so they cannot evict hot routes
+        self._cache = HandlerLRUCache(handler_cache_capacity)
+        self._negative_cache = HandlerLRUCache(negative_cache_capacity)
+
         if json_response_class is None:
             self.json_response_class = self._generate_json_response_class()
         else:
             self.json_response_class = json_response_class
 
+        self.streaming_json_response_class = self._generate_streaming_json_response_class()
+
         if not_found_response_class is None:
             self.not_found_response_class = self._generate_not_found_response_class()
         else:
@@ -95,72 +161,79 @@ class Rocinante(object):
 
     def wsgi_app(self, environ: dict, start_response):
 
-        request = self.request_class(environ)
+        request = self._request_class(environ)
 
         # iterate process_request of middlewares
-        _process_request = self._iter_process_request(request)
+        try:
+            _process_request = self._iter_process_request(request)
+        except HTTPException as exception:
+            _process_request = self._make_http_exception_response(exception)
         if isinstance(_process_request, Response):
             return _process_request(environ, start_response)
 
-        # try to get cached handler
-        cached_dict = self._cache.get(request.path)
+        # try to match mounted wsgi apps, the longest mounted prefix wins
+        # an app mounted at "/" only receives requests that no route matches
+        mounted = self._mounted_wsgi_apps.match(request.path) if self._mounted_wsgi_apps else None
+        if mounted is not None and mounted[0] != '/':
+            return self._call_mounted_app(mounted, environ, request, start_response)
 
-        # success get cached endpoint
-        # only handle cbv
-        if cached_dict is not None:
-            handler = cached_dict['handler']
-            kwargs = cached_dict['kwargs']
+        dispatch_key = (request.method, request.host, request.path)
 
-            response = self._handle_cbv(request, handler, kwargs, environ, start_response)
-            # If the response is complete
-            if isinstance(response, ClosingIterator):
-                return response
+        # try to get cached 404/405 result
+        cached_status = self._negative_cache.get(dispatch_key)
+        if cached_status is not None:
+            return self._make_error_response_class(cached_status)()(environ, start_response)
 
-        # cannot get cached handler
-        else:
+        # try to get cached endpoint, handler, kwargs and allowed methods
+        dispatch = self._cache.get(dispatch_key)
 
-            # get adapter
-            adapter = self.url_map.bind_to_environ(environ)
+        # cannot get cached dispatch
+        if dispatch is None:
 
             # try to match the endpoint and kwargs
             try:
-                endpoint, kwargs = adapter.match()
+                rule, kwargs = self._match_rule(request, environ)
 
-                # If the response is complete
-                check_static_file_url = self._check_static_file_url(request, kwargs, environ, start_response)
-                if isinstance(check_static_file_url, ClosingIterator):
-                    return check_static_file_url
+                if not self._static_file_exists(request, kwargs):
+                    return self.not_found_response_class()(environ, start_response)
 
             except NotFound:
 
-                # try to match mounted wsgi apps
-                for path, wsgi_app in self._mounted_wsgi_apps.items():
-                    if request.path.startswith(path):
-                        environ = self._process_environ(environ, request, path)
-                        mounted_wsgi_app_response = wsgi_app(environ, start_response)
-                        return mounted_wsgi_app_response
+                # fall back to the app mounted at "/"
+                if mounted is not None:
+                    return self._call_mounted_app(mounted, environ, request, start_response)
 
+                self._negative_cache.set(dispatch_key, 404)
                 return self.not_found_response_class()(environ, start_response)
 
-            # handle fbv
-            if isfunction(endpoint):
+            dispatch = self._build_dispatch(rule, kwargs)
+
+            if request.method not in dispatch['allow_methods']:
+                status_code = 405 if dispatch['allow_methods'] else 404
+                self._negative_cache.set(dispatch_key, status_code)
+                return self._make_error_response_class(status_code)()(environ, start_response)
+
+            self._cache.set(dispatch_key, dispatch)
 
-                response = self._handle_fbv(request, endpoint, kwargs, environ, start_response)
-                # If the response is complete
-                if isinstance(response, ClosingIterator):
-                    return response
+        try:
+            # reject oversized uploads before the body is read
+            if dispatch['upload_limits'] is not None:
+                request.set_upload_limits(dispatch['upload_limits'])
+
+            # handle fbv
+            if dispatch['handler'] is None:
+                response = self._handle_fbv(request, dispatch['endpoint'], dispatch['kwargs'], environ, start_response)
+            # handle cbv
             else:
-                handler = endpoint(application=self)
+                response = self._handle_cbv(request, dispatch['handler'], dispatch['kwargs'], environ, start_response)
 
-                self._cache.set(request.path, {
-                    'handler': handler,
-                    'kwargs': kwargs
-                })
+        # e.g. malformed json body
+        except HTTPException as exception:
+            response = self._make_http_exception_response(exception)
 
-                response = self._handle_cbv(request, handler, kwargs, environ, start_response)
-                # If the response is complete
-                if isinstance(response, ClosingIterator):
-                    return response
+        # If the response is complete
+        if isinstance(response, ClosingIterator):
+            return response
 
         # process object not the instance of Response class
         if not isinstance(response, Response):
@@ -172,6 +245,12 @@ class Rocinante(object):
         # call response object and return it
         return response(environ, start_response)
 
+    async def asgi_app(self, scope: dict, receive, send):
+        """
+        asgi entry point, e.g. uvicorn module:app.asgi_app, views and middleware hooks may be async def
+        """
+        await self._asgi_handler(scope, receive, send)
+
     def websocket_app(self, environ: dict, start_response):
         # get adapter
         adapter = self.websocket_url_map.bind_to_environ(environ)
@@ -190,20 +269,49 @@ class Rocinante(object):
         self.websocket_url_map.add(Rule(rule, endpoint=handler))
         self.websocket_apps[rule] = handler
 
-    def route(self, rule, *, methods=['GET']):
+    def route(self, rule, *, methods=['GET'], upload_limits: UploadLimits = None):
+        """
+        upload_limits sets the body size limits and the spooling of uploaded files of this route
+        """
         self._check_methods(methods)
 
         def wrapper(fbv):
             fbv.allow_methods = methods
-            self.url_map.add(Rule(rule, endpoint=fbv))
+            self._add_rule(self._make_rule(rule, fbv, upload_limits))
             return fbv
 
         return wrapper
 
-    def add_handler(self, rule, handler):
-        self.url_map.add(Rule(rule, endpoint=handler))
+    def add_handler(self, rule, handler, *, upload_limits: UploadLimits = None):
+        self._add_rule(self._make_rule(rule, handler, upload_limits))
 
-    def add_static_file_handler(self, handler, *, prefix: str, file_dir: str):
+    def add_static_file_handler(
+            self,
+            handler,
+            *,
+            prefix: str,
+            file_dir: str,
+            cache_control: str = None,
+            memory_cache_size: int = 0,
+            memory_cache_max_file_size: int = 64 * 1024,
+            memory_cache_revalidate_interval: float = 1.0,
+            precompressed: bool = False,
+            compress: bool = False,
+            compress_cache_size: int = 16 * 1024 * 1024,
+            compress_max_file_size: int = 4 * 1024 * 1024,
+            fingerprint: bool = False
+    ):
+        """
+        cache_control: Cache-Control header value of the files under this prefix, e.g. "public, max-age=3600"
+        memory_cache_size: keep up to this many bytes of small files in memory, 0 disables the memory cache
+        memory_cache_max_file_size: larger files bypass the memory cache
+        memory_cache_revalidate_interval: seconds between two mtime/size checks of a cached file
+        precompressed: serve "<file>.br"/"<file>.gz" siblings to clients accepting br/gzip
+        compress: gzip text, json and svg files once and keep up to compress_cache_size bytes of compressed files
+        compress_max_file_size: larger files are sent uncompressed
+        fingerprint: hash the files into a manifest now, static_url() then returns "name.<hash>.ext" urls
+                     that are served with an immutable Cache-Control, call build_static_manifest() after changing files
+        """
         if not prefix.startswith('/'):
             raise Exception('Invalid prefix.')
 
@@ -211,8 +319,70 @@ class Rocinante(object):
             raise Exception('This handler prefix is already exists.')
 
         rule = prefix + '/<filename>'
-        self.url_map.add(Rule(rule, endpoint=handler))
         self.static_file_handlers[prefix] = file_dir
+        self.static_file_options[prefix] = {
+            'cache_control': cache_control,
+            'memory_cache': StaticFileCache(
+                memory_cache_size,
+                memory_cache_max_file_size,
+                memory_cache_revalidate_interval
+            ) if memory_cache_size else None,
+            'precompressed': precompressed,
+            'compressed_cache': StaticFileCache(
+                compress_cache_size,
+                compress_max_file_size,
+                memory_cache_revalidate_interval
+            ) if compress else None,
+            # original filename -> fingerprinted filename, and the reverse
+            'manifest': {},
+            'fingerprinted_files': {}
+        }
+
+        if fingerprint:
+            self.build_static_manifest(prefix)
+
+        self._add_rule(Rule(rule, endpoint=handler))
+
+    def build_static_manifest(self, prefix: str):
+        """
+        hash the files served under prefix into its manifest
+        """
+        file_dir = self.static_file_handlers[prefix]
+
+        manifest = {}
+        for entry in os.scandir(file_dir):
+            if not entry.is_file():
+                continue
+
+            file_hash = hashlib.sha256()
+            with open(entry.path, 'rb') as f:
+                for chunk in iter(lambda: f.read(64 * 1024), b''):
+                    file_hash.update(chunk)
+
+            # app.js -> app.<hash>.js
+            name, extension = os.path.splitext(entry.name)
+            manifest[entry.name] = f'{name}.{file_hash.hexdigest()[:16]}{extension}'
+
+        options = self.static_file_options[prefix]
+        options['manifest'] = manifest
+        options['fingerprinted_files'] = {value: key for key, value in manifest.items()}
+        self._clear_dispatch_cache()
+
+    def static_url(self, path: str):
+        """
+        "/js/app.js" -> "/js/app.<hash>.js", paths missing from the manifests are returned as is
+        """
+        segments = path.split('/', 2)
+
+        if len(segments) == 3:
+            prefix, filename = '/' + segments[1], segments[2]
+            options = self.static_file_options.get(prefix)
+            if options is not None:
+                fingerprinted_filename = options['manifest'].get(filename)
+                if fingerprinted_filename is not None:
+                    return prefix + '/' + fingerprinted_filename
+
+        return path
 
     @staticmethod
     def startup():
@@ -222,15 +392,30 @@ class Rocinante(object):
 
         return wrapper
 
+    def worker_startup(self):
+        """
+        run the event in every worker of run_prefork after it is forked
+        """
+
+        def wrapper(event):
+            self._worker_startup_events.append(event)
+            return event
+
+        return wrapper
+
+    def run_worker_startup_events(self):
+        for event in self._worker_startup_events:
+            event()
+
     def include_router(self, router, *, prefix: str = None):
         if not prefix.startswith('/'):
             raise Exception('Invalid prefix.')
 
         for rule in router.rules:
             if prefix is None:
-                self.url_map.add(rule)
+                self._add_rule(rule)
             else:
-                self.url_map.add(Rule(prefix + rule.rule, endpoint=rule.endpoint))
+                self._add_rule(self._make_rule(prefix + rule.rule, rule.endpoint, getattr(rule, 'upload_limits', None)))
 
         for websocket_rule in router.websocket_rules:
             if prefix is None:
@@ -257,7 +442,11 @@ class Rocinante(object):
         if not callable(app):
             raise Exception('Invalid wsgi application.')
 
-        self._mounted_wsgi_apps[path] = app
+        # normalize "/flask/" to "/flask"
+        path = '/' + '/'.join(segment for segment in path.split('/') if segment)
+
+        self._mounted_wsgi_apps.insert(path, app)
+        self._clear_dispatch_cache()
 
     def mount_asgi_app(self, app: Callable, *, path: str):
 
@@ -265,119 +454,322 @@ class Rocinante(object):
             raise Exception('Invalid asgi application.')
 
         wsgi_app = ASGIMiddleware(app)
+        self._mounted_asgi_apps[wsgi_app] = app
 
         self.mount_wsgi_app(wsgi_app, path=path)
 
-    def run(self, host: str = '0.0.0.0', port: int = 8000, *, debug: bool = True):
+    def compile_templates(
+            self,
+            template_dirs: Union[str, List[str]],
+            extensions=('html', 'htm', 'xml', 'jinja', 'jinja2', 'j2')
+    ):
+        """
+        load the templates with these extensions in template_dirs into the template cache, return their names
+        template_dirs are relative to the loader root, templates that fail to compile are reported and skipped
+        """
+        if isinstance(template_dirs, str):
+            template_dirs = [template_dirs]
+
+        template_environment = self.template_environment
+        template_names = self._list_templates(template_dirs, extensions)
 
-        if not self.websocket_apps:
+        # keep every compiled template in memory, a dict is jinja's unbounded template cache
+        cache = template_environment.cache
+        if cache is not None and len(template_names) > getattr(cache, 'capacity', len(template_names)):
+            template_environment.cache = {}
+
+        compiled_template_names = []
+        for template_name in template_names:
+            try:
+                template_environment.get_template(template_name)
+            except TemplateError as exception:
+                print(f'Failed to compile template "{template_name}": {exception}')
+                continue
+            compiled_template_names.append(template_name)
+
+        return compiled_template_names
+
+    def _list_templates(self, template_dirs: List[str], extensions):
+        # walk only the given directories, the loader root may hold a virtualenv or generated reports
+        root_dir = self.template_environment.loader.searchpath[0]
+        suffixes = tuple('.' + extension for extension in extensions)
+
+        template_names = []
+        for template_dir in template_dirs:
+            for dir_path, _, filenames in os.walk(os.path.join(root_dir, template_dir)):
+                for filename in filenames:
+                    if filename.endswith(suffixes):
+                        file_path = os.path.relpath(os.path.join(dir_path, filename), root_dir)
+                        template_names.append(file_path.replace(os.path.sep, '/'))
+
+        return sorted(template_names)
+
+    def run(
+            self,
+            host: str = '0.0.0.0',
+            port: int = 8000,
+            *,
+            debug: bool = True,
+            pool_size: int = None,
+            max_active_requests: int = None,
+            max_queued_requests: int = 0,
+            queue_timeout: float = None,
+            retry_after: int = 1
+    ):
+        """
+        pool_size bounds the connections gevent serves at once and runs the app with gevent even without websockets
+        max_active_requests bounds the requests handled at once, up to max_queued_requests more wait for a slot
+        for at most queue_timeout seconds, the others get 503 with Retry-After: retry_after
+        """
+
+        # production mode, templates are not checked for changes
+        if not debug:
+            self.template_environment.auto_reload = False
+
+        if not self.websocket_apps and pool_size is None and max_active_requests is None:
             run_simple(host, port, self, use_debugger=debug, use_reloader=debug)
 
         else:
-            print('Detected websocket, use gevent to run.')
-            server = WSGIServer((host, port), self, handler_class=GeventWebSocketHandler)
+            if self.websocket_apps:
+                print('Detected websocket, use gevent to run.')
+
+            application = self
+            if max_active_requests is not None:
+                application = AdmissionControl(
+                    self,
+                    max_active_requests,
+                    max_queued_requests,
+                    queue_timeout,
+                    retry_after
+                )
+
+            server = WSGIServer(
+                (host, port),
+                application,
+                handler_class=GeventWebSocketHandler,
+                spawn=Pool(pool_size) if pool_size is not None else 'default'
+            )
             server.serve_forever()
 
+    def run_prefork(
+            self,
+            host: str = '0.0.0.0',
+            port: int = 8000,
+            *,
+            workers: int = None,
+            worker_connections: int = 1000,
+            max_active_requests: int = None,
+            max_queued_requests: int = 0,
+            queue_timeout: float = None,
+            retry_after: int = 1,
+            max_requests: int = 0,
+            max_requests_jitter: int = 0,
+            reuse_port: bool = False
+    ):
+        """
+        production mode, fork workers (one per cpu by default) that share the port and serve with gevent
+        worker_connections bounds the connections of every worker, like pool_size of run
+        max_active_requests, max_queued_requests, queue_timeout and retry_after shed load of every worker, see run
+        max_requests restarts a worker after it handled about that many requests, plus up to max_requests_jitter
+        reuse_port binds a SO_REUSEPORT socket in every worker instead of sharing the socket of the master
+        """
+        self.template_environment.auto_reload = False
+
+        server = PreforkServer(
+            self,
+            host,
+            port,
+            workers=workers,
+            worker_connections=worker_connections,
+            max_active_requests=max_active_requests,
+            max_queued_requests=max_queued_requests,
+            queue_timeout=queue_timeout,
+            retry_after=retry_after,
+            max_requests=max_requests,
+            max_requests_jitter=max_requests_jitter,
+            reuse_port=reuse_port
+        )
+        server.serve_forever()
+
     @staticmethod
     def _get_file_loader(import_name: str):
         root_dir = os.path.dirname(os.path.abspath(import_name))
         loader = FileSystemLoader(root_dir)
         return loader
 
-    def _build_request_arguments(self, original_arguments: dict, request: Request, annotations: dict):
-        request_arguments = {}
-
-        reverse_annotations = {
-            value: key for key, value in annotations.items() if key not in original_arguments
-        }
+    def _build_request_arguments(self, original_arguments: dict, request: Request, view: Callable):
+        plan_key = (view, frozenset(original_arguments))
+        plan = self._request_arguments_plans.get(plan_key)
 
-        adapted_arguments_mapping = self._adapt_arguments_mapping(reverse_annotations)
+        # the view was not registered through this application, compile it on first use
+        if plan is None:
+            plan = self._compile_request_arguments(view, original_arguments.keys())
+            self._request_arguments_plans[plan_key] = plan
 
-        args_mapping = {
-            key: {'position_name': value, 'mapping_name': adapted_arguments_mapping[key]} for key, value in
-            reverse_annotations.items()
-        }
-
-        for arg_type, arg_name_dict in args_mapping.items():
-            position_name = arg_name_dict['position_name']
-            mapping_name = arg_name_dict['mapping_name']
-            if mapping_name == 'request':
-                request_arguments[position_name] = request
-            else:
-                request_arguments[position_name] = getattr(request, mapping_name)
+        request_arguments = {position_name: getter(request) for position_name, getter in plan}
 
         request_arguments.update(original_arguments)
 
         return request_arguments
 
     @staticmethod
-    def _adapt_arguments_mapping(reverse_annotations: dict):
-
-        adapted_arguments_mapping = SUPPORT_ARGUMENTS_MAPPING.copy()
-
-        for arg_type in reverse_annotations:
+    def _compile_request_arguments(view: Callable, path_arguments):
+        """
+        resolve the annotations of view into (position name, getter) pairs once, unsupported types raise here
+        """
+        plan = []
 
-            if SUPPORT_ARGUMENTS_MAPPING.get(arg_type, None) is None:
+        for position_name, arg_type in view.__annotations__.items():
+            if position_name == 'return' or position_name in path_arguments:
+                continue
 
-                adapted = False
+            mapping_name = SUPPORT_ARGUMENTS_MAPPING.get(arg_type, None)
 
-                for support_type in SUPPORT_ARGUMENTS_MAPPING:
+            if mapping_name is None and isinstance(arg_type, type):
+                for support_type, support_mapping_name in SUPPORT_ARGUMENTS_MAPPING.items():
                     if issubclass(arg_type, support_type):
-                        adapted_arguments_mapping[arg_type] = adapted_arguments_mapping.pop(support_type)
-                        adapted = True
+                        mapping_name = support_mapping_name
                         break
 
-                if not adapted:
-                    raise Exception(
-                        f'Unsupported request argument:{reverse_annotations[arg_type]}. Wrong argument type:{arg_type}'
-                    )
+            if mapping_name is None:
+                raise Exception(
+                    f'Unsupported request argument:{position_name}. Wrong argument type:{arg_type}'
+                )
+
+            if mapping_name == 'request':
+                getter = _get_request
+            else:
+                getter = attrgetter(mapping_name)
+
+            plan.append((position_name, getter))
 
-        return adapted_arguments_mapping
+        return tuple(plan)
 
-    def _check_static_file_url(self, request, kwargs, environ, start_response):
+    def _compile_view(self, endpoint, path_arguments):
+        # fbv
+        if isfunction(endpoint):
+            plan_key = (endpoint, frozenset(path_arguments))
+            self._request_arguments_plans[plan_key] = self._compile_request_arguments(endpoint, path_arguments)
+
+        # cbv, compile per http method
+        else:
+            for method_name in self.http_method_names:
+                method = getattr(endpoint, method_name, None)
+                if isfunction(method):
+                    plan_key = (method, frozenset(path_arguments))
+                    self._request_arguments_plans[plan_key] = self._compile_request_arguments(method, path_arguments)
+
+    @staticmethod
+    def _make_rule(rule: str, endpoint, upload_limits: UploadLimits = None):
+        rule = Rule(rule, endpoint=endpoint)
+        rule.upload_limits = upload_limits
+        return rule
+
+    def _add_rule(self, rule: Rule):
+        self.url_map.add(rule)
+        self._compile_view(rule.endpoint, rule.arguments)
+        self._index_static_rule(rule)
+        self._clear_dispatch_cache()
+
+    def _index_static_rule(self, rule: Rule):
+        # only rules without converters can be matched by an exact path
+        if rule.arguments or rule.build_only or rule.redirect_to is not None:
+            return
+
+        if self.url_map.host_matching or rule.subdomain:
+            return
+
+        # werkzeug matches the first registered rule, keep it
+        if rule.rule in self._static_rules:
+            return
+
+        # copy on write, so the table that requests read is never mutated
+        static_rules = self._static_rules.copy()
+        static_rules[rule.rule] = rule
+        self._static_rules = static_rules
+
+    def _match_rule(self, request: Request, environ: dict):
+        # try the exact path table first
+        rule = self._static_rules.get(request.path)
+        if rule is not None:
+            return rule, {}
+
+        # parameterized rules fall through to werkzeug
+        adapter = self.url_map.bind_to_environ(environ)
+        return adapter.match(return_rule=True)
+
+    def _static_file_exists(self, request, kwargs):
         for static_file_handlers_prefix in self.static_file_handlers.keys():
             if request.path.startswith(static_file_handlers_prefix):
                 filename = kwargs['filename']
+                filename = self.static_file_options[static_file_handlers_prefix]['fingerprinted_files'].get(
+                    filename, filename
+                )
                 file_dir = self.static_file_handlers[static_file_handlers_prefix]
                 file_path = os.path.join(file_dir, filename)
                 if not os.path.exists(file_path):
-                    return self.not_found_response_class()(environ, start_response)
+                    return False
+        return True
+
+    def _build_dispatch(self, rule: Rule, kwargs):
+        endpoint = rule.endpoint
+
+        # rules added to url_map directly carry no upload limits
+        upload_limits = getattr(rule, 'upload_limits', None)
+
+        # fbv
+        if isfunction(endpoint):
+            return {
+                'endpoint': endpoint,
+                'handler': None,
+                'kwargs': kwargs,
+                'allow_methods': frozenset(method.upper() for method in endpoint.allow_methods),
+                'upload_limits': upload_limits
+            }
+
+        # cbv
+        handler = endpoint(application=self)
+        return {
+            'endpoint': endpoint,
+            'handler': handler,
+            'kwargs': kwargs,
+            'allow_methods': frozenset(method.upper() for method in handler.implement_method),
+            'upload_limits': upload_limits
+        }
+
+    def _clear_dispatch_cache(self):
+        self._cache.clear()
+        self._negative_cache.clear()
 
     def _handle_cbv(self, request, handler, kwargs, environ, start_response):
-        method = getattr(handler, request.method.lower(), None)
-        if method is None:
-            implement_method = handler.implement_method
-            if len(implement_method) >= 1:
-                return self.method_not_allowed_response_class()(environ, start_response)
-            else:
-                return self.not_found_response_class()(environ, start_response)
+        method = getattr(handler, request.method.lower())
 
         # iterate process_view of middlewares
         _process_view = self._iter_process_view(request, method)
         if isinstance(_process_view, Response):
             return _process_view(environ, start_response)
 
-        request_arguments = self._build_request_arguments(kwargs, request, method.__annotations__)
+        request_arguments = self._build_request_arguments(kwargs, request, method.__func__)
 
         response = method(**request_arguments)
         return response
 
     def _handle_fbv(self, request, endpoint, kwargs, environ, start_response):
-        allow_methods = endpoint.allow_methods
-        if request.method not in allow_methods:
-            return self.method_not_allowed_response_class()(environ, start_response)
-
         # iterate process_view of middlewares
         _process_view = self._iter_process_view(request, endpoint)
         if isinstance(_process_view, Response):
             return _process_view(environ, start_response)
 
-        request_arguments = self._build_request_arguments(kwargs, request, endpoint.__annotations__)
+        request_arguments = self._build_request_arguments(kwargs, request, endpoint)
 
         response = endpoint(**request_arguments)
         return response
 
     def _process_response(self, response):
+        if iscoroutine(response):
+            response.close()
+            raise Exception('Async views are only supported by the asgi entry point "asgi_app".')
+
         if isinstance(response, tuple):
             if len(response) < 1 or len(response) > 2:
                 raise Exception('Invalid tuple.')
@@ -423,7 +815,18 @@ class Rocinante(object):
                 if not issubclass(processed_response_class, Response):
                     raise Exception('Invalid response class.')
 
+    def _generate_request_class(self):
+
+        class _Request(self.request_class):
+            json_codec = self.json_codec
+            json_max_size = self.json_max_size
+
+        _Request.__name__ = _Request.__qualname__ = self.request_class.__name__
+
+        return _Request
+
     def _generate_json_response_class(self):
+        json_codec = self.json_codec
 
         class JSONResponse(self.response_class):
 
@@ -436,11 +839,18 @@ class Rocinante(object):
                     content_type=None,
                     direct_passthrough=False,
             ):
-                response = json.dumps(response)
+                response = json_codec.dumps(response)
                 super().__init__(response, status, headers, mimetype, content_type, direct_passthrough)
 
         return JSONResponse
 
+    def _generate_streaming_json_response_class(self):
+
+        class StreamingJSONResponse(_StreamingJSONResponse, self.response_class):
+            json_codec = self.json_codec
+
+        return StreamingJSONResponse
+
     def _generate_not_found_response_class(self):
 
         class NotFoundResponse(self.response_class):
@@ -475,8 +885,15 @@ class Rocinante(object):
 
         return MethodNotAllowedResponse
 
+    def _call_mounted_app(self, mounted, environ, request, start_response):
+        path, wsgi_app = mounted
+        environ = self._process_environ(environ, request, path)
+        return wsgi_app(environ, start_response)
+
     @staticmethod
     def _process_environ(environ, request, path):
+        if path == '/':
+            return environ
         wsgi_app_url_location = len(path)
         wsgi_app_url = request.path[wsgi_app_url_location:]
         environ['PATH_INFO'] = wsgi_app_url
@@ -484,7 +901,23 @@ class Rocinante(object):
         environ['RAW_URI'] = wsgi_app_url
         return environ
 
+    def _make_http_exception_response(self, exception: HTTPException):
+        return self.json_response_class(
+            {
+                'error': exception.description
+            },
+            exception.code
+        )
+
+    def _make_error_response_class(self, status_code):
+        if status_code == 405:
+            return self.method_not_allowed_response_class
+        return self.not_found_response_class
+
     def _make_response(self, content, status=None):
+        # stream generators instead of serializing them in one shot
+        if isinstance(content, GeneratorType):
+            return self.streaming_json_response_class(content, status)
         if isinstance(content, Iterable):
             return self.json_response_class(content, status)
 
@@ -0,0 +1,481 @@
+import asyncio
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from inspect import CORO_CREATED, getcoroutinestate, isawaitable, iscoroutinefunction
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+
+from a2wsgi import WSGIMiddleware
+from a2wsgi.wsgi import build_environ
+from geventwebsocket import WebSocketError
+from werkzeug import Response
+from werkzeug.exceptions import HTTPException, NotFound, ClientDisconnected
+
+from .request import UploadTooLarge
+
+
+async def _maybe_await(result):
+    if isawaitable(result):
+        result = await result
+    return result
+
+
+class ASGIWebSocket(object):
+    """
+    ASGI websocket with the interface of geventwebsocket's WebSocket, receive, send and close return coroutines.
+    send and close coroutines a sync hook did not await are run by flush.
+    """
+
+    def __init__(self, environ: dict, receive, send):
+        self.environ = environ
+        self.closed = False
+        self._receive = receive
+        self._send = send
+        self._pending = []
+
+    async def receive(self):
+        """
+        return the next text or bytes message, raise WebSocketError once the client is gone
+        """
+        if self.closed:
+            raise WebSocketError('Websocket is closed.')
+
+        message = await self._receive()
+        if message['type'] == 'websocket.disconnect':
+            self.closed = True
+            raise WebSocketError('Websocket is closed.')
+
+        if message.get('text') is not None:
+            return message['text']
+        return message.get('bytes')
+
+    def send(self, message, binary: bool = None):
+        return self._track(self._send_message(message, binary))
+
+    def close(self, code: int = 1000, message=b''):
+        return self._track(self._close(code, message))
+
+    async def flush(self):
+        """
+        run the send and close coroutines nobody awaited, in the order they were created
+        """
+        pending, self._pending = self._pending, []
+        for coroutine in pending:
+            if getcoroutinestate(coroutine) == CORO_CREATED:
+                await coroutine
+
+    def _track(self, coroutine):
+        # awaited coroutines are done by the next call, keep only the others
+        self._pending = [pending for pending in self._pending if getcoroutinestate(pending) == CORO_CREATED]
+        self._pending.append(coroutine)
+        return coroutine
+
+    async def _send_message(self, message, binary: bool = None):
+        if self.closed:
+            raise WebSocketError('Websocket is closed.')
+
+        if binary or isinstance(message, (bytes, bytearray)):
+            await self._send({'type': 'websocket.send', 'bytes': bytes(message)})
+        else:
+            await self._send({'type': 'websocket.send', 'text': message})
+
+    async def _close(self, code: int = 1000, message=b''):
+        if self.closed:
+            return
+
+        self.closed = True
+        if isinstance(message, bytes):
+            message = message.decode()
+        await self._send({'type': 'websocket.close', 'code': code, 'reason': message})
+
+
+class _BlockingWebSocket(object):
+    """
+    blocking facade of an ASGIWebSocket for sync websocket handlers running in the thread pool
+    """
+
+    def __init__(self, websocket: ASGIWebSocket, loop: asyncio.AbstractEventLoop):
+        self.websocket = websocket
+        self.environ = websocket.environ
+        self._loop = loop
+
+    @property
+    def closed(self):
+        return self.websocket.closed
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def receive(self):
+        return self._run(self.websocket.receive())
+
+    def send(self, message, binary: bool = None):
+        return self._run(self.websocket.send(message, binary))
+
+    def close(self, code: int = 1000, message=b''):
+        return self._run(self.websocket.close(code, message))
+
+
+class ASGIHandler(object):
+    """
+    Serve a Rocinante application over ASGI, see Rocinante.asgi_app.
+    async def views, CBV methods, middleware hooks and websocket handlers run on the event loop,
+    sync ones run in a thread pool of max_workers threads. A sync websocket handler holds a thread of its own pool
+    while it is open, connections beyond max_sync_websockets are refused with close code 1013.
+    The body of a request that matches a route is received before process_request runs and spooled to disk
+    past memory_threshold, upload limits of the route apply.
+    """
+
+    # bodies larger than this are spooled to disk when the route sets no upload limits
+    memory_threshold = 1024 * 1024
+
+    # sync websocket handlers open at once, each one holds a thread
+    max_sync_websockets = 64
+
+    def __init__(self, application, max_workers: int = None):
+        self.application = application
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='rocinante')
+
+        # long lived sync websocket handlers must not starve sync views
+        self.websocket_executor = ThreadPoolExecutor(
+            max_workers=self.max_sync_websockets,
+            thread_name_prefix='rocinante-websocket'
+        )
+        self._sync_websockets = 0
+
+        # mounted wsgi apps wrapped once for asgi
+        self._wrapped_wsgi_apps = {}
+
+    async def __call__(self, scope: dict, receive, send):
+        scope_type = scope['type']
+
+        if scope_type == 'http':
+            await self._handle_http(scope, receive, send)
+        elif scope_type == 'websocket':
+            await self._handle_websocket(scope, receive, send)
+        elif scope_type == 'lifespan':
+            await self._handle_lifespan(scope, receive, send)
+
+    async def _run_in_executor(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(function, *args))
+
+    async def _handle_http(self, scope: dict, receive, send):
+        environ = build_environ(scope, BytesIO())
+        try:
+            response = await self._dispatch(scope, environ, receive, send)
+            if response is not None:
+                await self._send_response(response, environ, send)
+        finally:
+            environ['wsgi.input'].close()
+
+    async def _dispatch(self, scope: dict, environ: dict, receive, send):
+        """
+        the asgi version of Rocinante.wsgi_app, return the response or None once a mounted app responded
+        """
+        application = self.application
+        request = application._request_class(environ)
+
+        # the longest mounted prefix wins, an app mounted at "/" only receives requests that no route matches
+        mounted = application._mounted_wsgi_apps.match(request.path) if application._mounted_wsgi_apps else None
+
+        dispatch_key = (request.method, request.host, request.path)
+        cached_status = None
+        dispatch = None
+        rule = kwargs = None
+
+        if mounted is None or mounted[0] == '/':
+            cached_status = application._negative_cache.get(dispatch_key)
+            if cached_status is None:
+                dispatch = application._cache.get(dispatch_key)
+                if dispatch is None:
+                    try:
+                        rule, kwargs = application._match_rule(request, environ)
+                    except NotFound:
+                        pass
+
+        # only requests that reach a view are received, mounted apps read the body themselves
+        if dispatch is not None or rule is not None:
+            upload_limits = dispatch['upload_limits'] if dispatch is not None else getattr(rule, 'upload_limits', None)
+            try:
+                await self._receive_body(environ, receive, upload_limits)
+            except HTTPException as exception:
+                return application._make_http_exception_response(exception)
+
+        # iterate process_request of middlewares
+        try:
+            response = await self._iter_process_request(request)
+        except HTTPException as exception:
+            response = application._make_http_exception_response(exception)
+        if response is not None:
+            return response
+
+        if mounted is not None and mounted[0] != '/':
+            return await self._call_mounted_app(mounted, scope, receive, send)
+
+        if cached_status is not None:
+            return application._make_error_response_class(cached_status)()
+
+        if dispatch is None:
+            if rule is None:
+                # fall back to the app mounted at "/"
+                if mounted is not None:
+                    return await self._call_mounted_app(mounted, scope, receive, send)
+
+                application._negative_cache.set(dispatch_key, 404)
+                return application.not_found_response_class()
+
+            if not application._static_file_exists(request, kwargs):
+                return application.not_found_response_class()
+
+            dispatch = application._build_dispatch(rule, kwargs)
+
+            if request.method not in dispatch['allow_methods']:
+                status_code = 405 if dispatch['allow_methods'] else 404
+                application._negative_cache.set(dispatch_key, status_code)
+                return application._make_error_response_class(status_code)()
+
+            application._cache.set(dispatch_key, dispatch)
+
+        try:
+            if dispatch['upload_limits'] is not None:
+                request.set_upload_limits(dispatch['upload_limits'])
+
+            # fbv
+            if dispatch['handler'] is None:
+                response = await self._call_view(request, dispatch['endpoint'], dispatch['endpoint'], dispatch['kwargs'])
+            # cbv
+            else:
+                method = getattr(dispatch['handler'], request.method.lower())
+                response = await self._call_view(request, method, method.__func__, dispatch['kwargs'])
+
+        # e.g. malformed json body
+        except HTTPException as exception:
+            response = application._make_http_exception_response(exception)
+
+        # process object not the instance of Response class, sync views did it in their thread
+        if not isinstance(response, Response):
+            response = application._process_response(response)
+
+        # iterate process_response of middlewares
+        return await self._iter_process_response(request, response)
+
+    async def _receive_body(self, environ: dict, receive, upload_limits):
+        max_content_length = memory_threshold = upload_dir = None
+        if upload_limits is not None:
+            max_content_length = upload_limits.max_content_length
+            memory_threshold = upload_limits.memory_threshold
+            upload_dir = upload_limits.upload_dir
+
+        # refuse before receiving the body when the client announces its size
+        content_length = environ.get('CONTENT_LENGTH')
+        if max_content_length is not None and content_length and int(content_length) > max_content_length:
+            raise UploadTooLarge()
+
+        body = SpooledTemporaryFile(
+            max_size=memory_threshold if memory_threshold is not None else self.memory_threshold,
+            mode='w+b',
+            dir=upload_dir
+        )
+        environ['wsgi.input'] = body
+        size = 0
+
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                raise ClientDisconnected()
+
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if max_content_length is not None and size > max_content_length:
+                raise UploadTooLarge()
+            body.write(chunk)
+
+            if not message.get('more_body', False):
+                break
+
+        body.seek(0)
+
+        # chunked bodies are complete now, werkzeug reads the input up to the content length
+        environ['CONTENT_LENGTH'] = str(size)
+
+    async def _call_view(self, request, view, function, kwargs: dict):
+        application = self.application
+
+        # iterate process_view of middlewares
+        response = await self._iter_process_view(request, view)
+        if response is not None:
+            return response
+
+        if iscoroutinefunction(function):
+            request_arguments = application._build_request_arguments(kwargs, request, function)
+            return await view(**request_arguments)
+
+        response = await self._run_in_executor(self._call_sync_view, request, view, function, kwargs)
+
+        # a sync wrapper of an async view returned its coroutine
+        if isawaitable(response):
+            response = await response
+        return response
+
+    def _call_sync_view(self, request, view, function, kwargs: dict):
+        # parsing the form or json body may read a spooled file, keep it off the event loop too
+        request_arguments = self.application._build_request_arguments(kwargs, request, function)
+        response = view(**request_arguments)
+
+        # so is rendering templates and encoding json
+        if not isinstance(response, Response) and not isawaitable(response):
+            response = self.application._process_response(response)
+        return response
+
+    async def _iter_process_request(self, request):
+        for middleware in self.application._middlewares:
+            _process_request = await _maybe_await(middleware.process_request(request))
+            if isinstance(_process_request, Response):
+                return _process_request
+
+    async def _iter_process_view(self, request, view):
+        if getattr(view, 'process_view_exempt', False):
+            return None
+
+        for middleware in self.application._middlewares:
+            _process_view = await _maybe_await(middleware.process_view(request, view))
+            if isinstance(_process_view, Response):
+                return _process_view
+
+    async def _iter_process_response(self, request, response):
+        for middleware in self.application._middlewares:
+            _process_response = await _maybe_await(middleware.process_response(request, response))
+            if isinstance(_process_response, Response):
+                response = _process_response
+        return response
+
+    async def _call_mounted_app(self, mounted, scope: dict, receive, send):
+        path, wsgi_app = mounted
+
+        # apps mounted with mount_asgi_app are called directly instead of through a2wsgi
+        asgi_app = self.application._mounted_asgi_apps.get(wsgi_app)
+        if asgi_app is None:
+            asgi_app = self._wrapped_wsgi_apps.get(wsgi_app)
+            if asgi_app is None:
+                asgi_app = self._wrapped_wsgi_apps[wsgi_app] = WSGIMiddleware(wsgi_app)
+
+        if path != '/':
+            scope = dict(scope, root_path=scope.get('root_path', '') + path)
+
+        await asgi_app(scope, receive, send)
+
+    async def _send_response(self, response: Response, environ: dict, send):
+        app_iter, status, headers = response.get_wsgi_response(environ)
+
+        await send({
+            'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [(key.lower().encode('latin-1'), value.encode('latin-1')) for key, value in headers]
+        })
+
+        try:
+            # buffered bodies are already in memory, send them in one message
+            if response.is_sequence:
+                await send({'type': 'http.response.body', 'body': b''.join(app_iter)})
+                return
+
+            # files and generators may block, pull every chunk in the thread pool
+            iterator = iter(app_iter)
+            while True:
+                chunk = await self._run_in_executor(next, iterator, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+            await send({'type': 'http.response.body', 'body': b''})
+
+        finally:
+            close = getattr(app_iter, 'close', None)
+            if close is not None:
+                close()
+
+    async def _handle_websocket(self, scope: dict, receive, send):
+        application = self.application
+
+        # websocket scopes carry no method, and werkzeug matches websocket rules only against http/https
+        environ = build_environ(dict(
+            scope,
+            method='GET',
+            http_version=scope.get('http_version', '1.1'),
+            scheme='https' if scope.get('scheme') == 'wss' else 'http'
+        ), BytesIO())
+
+        message = await receive()
+        if message['type'] != 'websocket.connect':
+            return
+
+        try:
+            rule, _ = application.websocket_url_map.bind_to_environ(environ).match(return_rule=True)
+        except HTTPException:
+            # closing before accepting rejects the handshake with 403
+            await send({'type': 'websocket.close', 'code': 1000})
+            return
+
+        handler_class = rule.endpoint
+        is_async = iscoroutinefunction(handler_class.on_message) or iscoroutinefunction(handler_class.on_open)
+
+        if not is_async and self._sync_websockets >= self.max_sync_websockets:
+            # try again later
+            await send({'type': 'websocket.close', 'code': 1013})
+            return
+
+        await send({'type': 'websocket.accept'})
+
+        websocket = ASGIWebSocket(environ, receive, send)
+
+        if is_async:
+            await self._handle_async_websocket(handler_class(websocket), websocket)
+        else:
+            self._sync_websockets += 1
+            try:
+                handler = handler_class(_BlockingWebSocket(websocket, asyncio.get_running_loop()))
+                await asyncio.get_running_loop().run_in_executor(self.websocket_executor, handler.handle)
+            finally:
+                self._sync_websockets -= 1
+
+        await websocket.close()
+
+    @staticmethod
+    async def _handle_async_websocket(handler, websocket: ASGIWebSocket):
+        # sync hooks of an async handler, e.g. the default on_message, do not await send
+        await _maybe_await(handler.on_open())
+        await websocket.flush()
+
+        while True:
+            try:
+                message = await websocket.receive()
+            except WebSocketError:
+                await _maybe_await(handler.on_close(None))
+                await websocket.flush()
+                break
+
+            if not websocket.closed:
+                await _maybe_await(handler.on_message(message))
+                await websocket.flush()
+
+    async def _handle_lifespan(self, scope: dict, receive, send):
+        while True:
+            message = await receive()
+
+            if message['type'] == 'lifespan.startup':
+                # every asgi worker process runs the worker startup events once
+                try:
+                    for event in self.application._worker_startup_events:
+                        await _maybe_await(event())
+                except Exception:
+                    await send({'type': 'lifespan.startup.failed', 'message': traceback.format_exc()})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                self.websocket_executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -1,43 +1,334 @@
+import os
+from collections import OrderedDict
+from threading import RLock
+from time import monotonic
 from typing import AnyStr, Any
 
 
 class HandlerLRUCache(object):
-    keys = []
+    """
+    O(1) LRU cache owned by a single application.
+    OrderedDict keeps the recency order as a linked list, the lock keeps it safe under threaded or gevent servers.
+    """
 
-    cache = {}
+    def __init__(self, handler_cache_capacity: int = 128):
+        if handler_cache_capacity is None or handler_cache_capacity < 1:
+            raise Exception('Invalid handler cache capacity.')
 
-    def __init__(self, handler_cache_capacity: int = None):
         self.handler_cache_capacity = handler_cache_capacity
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = RLock()
 
-    def is_head(self, key: AnyStr):
-        if self.keys.index(key) == 0:
-            return True
-        else:
-            return False
-
-    def get(self, key: AnyStr):
-        if key in self.keys:
-            if not self.is_head(key):
-                self.keys.remove(key)
-                self.keys.insert(0, key)
-            return self.cache[key]
-        else:
-            return None
+    def get(self, key: AnyStr, default: Any = None):
+        with self._lock:
+            try:
+                value = self.cache[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return value
 
     def set(self, key: AnyStr, value: Any):
-        if key not in self.keys:
-            if len(self.keys) >= self.handler_cache_capacity:
-                deleted_key = self.keys.pop(-1)
-                del self.cache[deleted_key]
-            self.keys.insert(0, key)
-            self.cache[key] = value
-        else:
-            if not self.is_head(key):
-                self.keys.remove(key)
-                self.keys.insert(0, key)
+        with self._lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+            elif len(self.cache) >= self.handler_cache_capacity:
+                self.cache.popitem(last=False)
+                self.evictions += 1
             self.cache[key] = value
 
-    def __get__(self, instance, owner):
-        return self.__class__(
-            instance.handler_cache_capacity
-        )
+    def delete(self, key: AnyStr):
+        with self._lock:
+            self.cache.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self.cache.clear()
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {
+                'capacity': self.handler_cache_capacity,
+                'size': len(self.cache),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+    def __contains__(self, key: AnyStr):
+        with self._lock:
+            return key in self.cache
+
+    def __len__(self):
+        return len(self.cache)
+
+
+class StaticFileCache(object):
+    """
+    LRU cache of small static files bounded by the total size of their contents.
+    An entry is revalidated against the file's mtime and size at most once per revalidate_interval seconds.
+    variant tells apart several representations of one file, e.g. its gzip compressed bytes.
+    """
+
+    def __init__(self, max_bytes: int, max_file_size: int = 64 * 1024, revalidate_interval: float = 1.0):
+        if max_bytes < 1:
+            raise Exception('Invalid static file cache size.')
+
+        self.max_bytes = max_bytes
+        self.max_file_size = min(max_file_size, max_bytes)
+        self.revalidate_interval = revalidate_interval
+        self.cache = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = RLock()
+
+    def accept(self, file_size: int):
+        return file_size <= self.max_file_size
+
+    def get(self, file_path: AnyStr, variant: str = ''):
+        key = (file_path, variant)
+
+        with self._lock:
+            entry = self.cache.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            now = monotonic()
+            if now - entry['checked_at'] >= self.revalidate_interval:
+                try:
+                    file_stat = os.stat(file_path)
+                except OSError:
+                    file_stat = None
+
+                if file_stat is None or (file_stat.st_mtime_ns, file_stat.st_size) != entry['version']:
+                    self._delete(key)
+                    self.misses += 1
+                    return None
+
+                entry['checked_at'] = now
+
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, file_path: AnyStr, file_stat: os.stat_result, content: bytes, variant: str = '', **extra):
+        """
+        file_stat is the stat of file_path, extra values (prebuilt headers, validators...) are kept in the entry as is
+        """
+        if not self.accept(len(content)):
+            return
+
+        key = (file_path, variant)
+
+        entry = {
+            'content': content,
+            'version': (file_stat.st_mtime_ns, file_stat.st_size),
+            'checked_at': monotonic(),
+            **extra
+        }
+
+        with self._lock:
+            self._delete(key)
+            while self.size + len(content) > self.max_bytes:
+                _, evicted = self.cache.popitem(last=False)
+                self.size -= len(evicted['content'])
+                self.evictions += 1
+            self.cache[key] = entry
+            self.size += len(content)
+
+    def delete(self, file_path: AnyStr, variant: str = ''):
+        with self._lock:
+            self._delete((file_path, variant))
+
+    def clear(self):
+        with self._lock:
+            self.cache.clear()
+            self.size = 0
+
+    def _delete(self, key: tuple):
+        entry = self.cache.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry['content'])
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {
+                'max_bytes': self.max_bytes,
+                'size': self.size,
+                'files': len(self.cache),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+    def __len__(self):
+        return len(self.cache)
+
+
+class RenderCache(HandlerLRUCache):
+    """
+    LRU cache of rendered templates whose entries expire ttl seconds after they were rendered.
+    Keys are (template path, key computed from the render context).
+    """
+
+    def __init__(self, capacity: int = 128, ttl: float = 60):
+        super().__init__(capacity)
+        self.ttl = ttl
+
+    def get(self, key: tuple, default: Any = None):
+        with self._lock:
+            entry = self.cache.get(key)
+            if entry is None or entry[0] <= monotonic():
+                if entry is not None:
+                    del self.cache[key]
+                self.misses += 1
+                return default
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: tuple, value: Any):
+        super().set(key, (monotonic() + self.ttl, value))
+
+    def invalidate(self, template_path: str = None, key: Any = None):
+        """
+        invalidate() drops everything, invalidate(template_path) every page of a template,
+        invalidate(template_path, key) a single page
+        """
+        with self._lock:
+            if template_path is None:
+                self.cache.clear()
+            elif key is not None:
+                self.cache.pop((template_path, key), None)
+            else:
+                for cache_key in [cache_key for cache_key in self.cache if cache_key[0] == template_path]:
+                    del self.cache[cache_key]
+
+
+class ResponseCache(object):
+    """
+    LRU cache of response entries bounded by the total size of their bodies.
+    The Vary header names of a resource are remembered per (path, query) while it has entries, the entries are keyed by
+    (path, query, values of these request headers).
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_entry_size: int = 1024 * 1024):
+        if max_bytes < 1:
+            raise Exception('Invalid response cache size.')
+
+        self.max_bytes = max_bytes
+        self.max_entry_size = min(max_entry_size, max_bytes)
+        self.cache = OrderedDict()
+        self.vary = {}
+        # (path, query) to the keys of its entries
+        self.resource_keys = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = RLock()
+
+    def make_key(self, path: str, query: bytes, headers):
+        resource = (path, query)
+        vary = self.vary.get(resource, ())
+        return resource + tuple(headers.get(name) for name in vary)
+
+    def get(self, key: tuple):
+        with self._lock:
+            entry = self.cache.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, path: str, query: bytes, headers, vary: tuple, entry: dict):
+        """
+        entry must hold the body bytes under "body"
+        """
+        body_size = len(entry['body'])
+        if body_size > self.max_entry_size:
+            return
+
+        with self._lock:
+            resource = (path, query)
+
+            # the resource changed its Vary header, the entries keyed by the old one are unreachable
+            if self.vary.get(resource, ()) != vary:
+                self._delete_resource(resource)
+
+            key = resource + tuple(headers.get(name) for name in vary)
+            self._delete(key)
+            while self.size + body_size > self.max_bytes:
+                evicted_key, evicted = self.cache.popitem(last=False)
+                self.size -= len(evicted['body'])
+                self._forget(evicted_key)
+                self.evictions += 1
+            self.cache[key] = entry
+            self.size += body_size
+            self.vary[resource] = vary
+            self.resource_keys.setdefault(resource, set()).add(key)
+
+    def delete(self, path: str, query: bytes = None):
+        """
+        delete the entries of path, only those of one query string if query is given
+        """
+        with self._lock:
+            resources = [resource for resource in self.vary if resource[0] == path and query in (None, resource[1])]
+            for resource in resources:
+                self._delete_resource(resource)
+
+    def clear(self):
+        with self._lock:
+            self.cache.clear()
+            self.vary.clear()
+            self.resource_keys.clear()
+            self.size = 0
+
+    def _delete(self, key: tuple):
+        entry = self.cache.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry['body'])
+            self._forget(key)
+
+    def _delete_resource(self, resource: tuple):
+        for key in list(self.resource_keys.get(resource, ())):
+            self._delete(key)
+        self.vary.pop(resource, None)
+
+    def _forget(self, key: tuple):
+        # drop the Vary record of a resource with its last entry, so it stays within the byte bound
+        resource = key[:2]
+        keys = self.resource_keys.get(resource)
+        if keys is None:
+            return
+        keys.discard(key)
+        if not keys:
+            del self.resource_keys[resource]
+            self.vary.pop(resource, None)
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {
+                'max_bytes': self.max_bytes,
+                'size': self.size,
+                'entries': len(self.cache),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+    def __len__(self):
+        return len(self.cache)
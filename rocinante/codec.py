@@ -0,0 +1,31 @@
+import json
+from typing import Any, Callable
+
+
+def _json_dumps(obj: Any):
+    return json.dumps(obj).encode()
+
+
+class JSONCodec(object):
+    """
+    JSON backend used for JSON responses and Request.json.
+    dumps may return bytes or str, loads must accept bytes, e.g. JSONCodec(orjson.dumps, orjson.loads).
+    The stdlib json module is used by default.
+    """
+
+    def __init__(self, dumps: Callable[[Any], Any] = None, loads: Callable[[bytes], Any] = None):
+        self._dumps = dumps if dumps is not None else _json_dumps
+        # json.loads detects the encoding of bytes itself
+        self._loads = loads if loads is not None else json.loads
+
+    def dumps(self, obj: Any) -> bytes:
+        data = self._dumps(obj)
+        if isinstance(data, str):
+            data = data.encode()
+        return data
+
+    def loads(self, data: bytes) -> Any:
+        return self._loads(data)
+
+
+default_json_codec = JSONCodec()
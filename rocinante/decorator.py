@@ -1,12 +1,68 @@
 from functools import wraps
+from inspect import iscoroutinefunction
+from typing import Callable
+
+from .cache import RenderCache
+from .response import Render
 
 
 def process_view_exempt(func):
     func.process_view_exempt = True
 
+    # async views must stay async for asgi_app
+    if iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            res = await func(*args, **kwargs)
+            return res
+
+        return async_wrapper
+
     @wraps(func)
     def wrapper(*args, **kwargs):
         res = func(*args, **kwargs)
         return res
 
     return wrapper
+
+
+def cache_render(render_cache: RenderCache = None, *, key: Callable[[dict], object], ttl: float = 60,
+                 capacity: int = 128):
+    """
+    cache the pages rendered from the Render objects returned by the view.
+    key computes the part of the cache key that comes from the render context, e.g. lambda context: context['user_id'],
+    contexts with the same key share one page, so it must cover everything that personalizes the page.
+    key=lambda context: None caches one page per template.
+    A RenderCache(capacity, ttl) is created when render_cache is not given, it is available as view.render_cache.
+    """
+    if not callable(key):
+        raise Exception('Invalid cache key.')
+
+    if render_cache is None:
+        render_cache = RenderCache(capacity, ttl)
+
+    def set_render_cache(res):
+        if isinstance(res, Render):
+            res.render_cache = render_cache
+            res.render_cache_key = key
+        return res
+
+    def decorator(func):
+
+        # async views must stay async for asgi_app
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                return set_render_cache(await func(*args, **kwargs))
+
+            async_wrapper.render_cache = render_cache
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return set_render_cache(func(*args, **kwargs))
+
+        wrapper.render_cache = render_cache
+        return wrapper
+
+    return decorator
@@ -0,0 +1,40 @@
+import asyncio
+
+from rocinante import Rocinante, Request, RequestHandler
+from rocinante.handler import WebsocketHandler
+
+app = Rocinante(__name__)
+
+
+# async views run on the event loop
+@app.route('/async')
+async def async_index(request: Request):
+    await asyncio.sleep(1)
+    return 'hello from the event loop'
+
+
+# sync views keep working, they run in a thread pool
+@app.route('/sync')
+def sync_index():
+    return 'hello from a thread'
+
+
+class ItemHandler(RequestHandler):
+
+    async def get(self, item_id):
+        return {
+            'item_id': item_id
+        }
+
+
+class EchoHandler(WebsocketHandler):
+
+    async def on_message(self, message):
+        await self.send(message)
+
+
+app.add_handler('/items/<item_id>', ItemHandler)
+app.add_websocket_handler('/echo', EchoHandler)
+
+# run with an asgi server, e.g. "uvicorn asgi_demo:asgi_app"
+asgi_app = app.asgi_app
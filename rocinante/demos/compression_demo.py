@@ -0,0 +1,17 @@
+from rocinante import Rocinante, Request
+from rocinante.middleware import CompressionMiddleware
+
+app = Rocinante(__name__)
+
+# gzip/deflate text and json responses of at least 500 bytes
+app.add_middleware(CompressionMiddleware, minimum_size=500)
+
+
+@app.route('/rows')
+def rows(request: Request):
+    # generators are streamed and compressed while they are sent
+    return ({'id': i} for i in range(100000))
+
+
+if __name__ == '__main__':
+    app.run('0.0.0.0', 8000)
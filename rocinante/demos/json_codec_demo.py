@@ -0,0 +1,25 @@
+from rocinante import Rocinante, Request, RequestJSON, JSONCodec
+
+# orjson is optional, "pip install Rocinante[orjson]"
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# encode json responses and decode Request.json with orjson when it is installed, the stdlib json module otherwise
+if orjson is not None:
+    json_codec = JSONCodec(dumps=orjson.dumps, loads=orjson.loads)
+else:
+    json_codec = JSONCodec()
+
+app = Rocinante(__name__, json_codec=json_codec)
+
+
+@app.route('/echo', methods=['POST'])
+def echo(request: Request, json: RequestJSON):
+    print(request.json)
+    return json
+
+
+if __name__ == '__main__':
+    app.run()
@@ -0,0 +1,23 @@
+from rocinante import Rocinante
+
+app = Rocinante(__name__)
+
+
+@app.route('/')
+def index():
+    return 'hello world'
+
+
+if __name__ == '__main__':
+    # at most 1000 connections, 200 requests handled at once and 400 waiting for at most 5 seconds,
+    # other requests get 503 with Retry-After: 2
+    app.run(
+        '0.0.0.0',
+        8000,
+        debug=False,
+        pool_size=1000,
+        max_active_requests=200,
+        max_queued_requests=400,
+        queue_timeout=5,
+        retry_after=2
+    )
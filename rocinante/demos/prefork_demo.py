@@ -0,0 +1,21 @@
+import os
+
+from rocinante import Rocinante
+
+app = Rocinante(__name__)
+
+
+@app.worker_startup()
+def connect():
+    # runs in every worker after it is forked, e.g. open database connections here
+    print(f'worker {os.getpid()} started!')
+
+
+@app.route('/')
+def index():
+    return f'hello from worker {os.getpid()}'
+
+
+if __name__ == '__main__':
+    # 4 workers sharing port 8000, each restarts after about 10000 requests
+    app.run_prefork('0.0.0.0', 8000, workers=4, max_requests=10000, max_requests_jitter=1000)
@@ -0,0 +1,22 @@
+import hashlib
+
+from rocinante import Rocinante, UploadLimits, RequestStream
+
+app = Rocinante(__name__)
+
+
+# hash the body chunk by chunk instead of reading it into memory, chunked bodies stop at 1GB
+@app.route('/ingest', methods=['POST'], upload_limits=UploadLimits(max_content_length=1024 * 1024 * 1024))
+def ingest(stream: RequestStream):
+    sha256 = hashlib.sha256()
+    for chunk in stream:
+        sha256.update(chunk)
+
+    return {
+        'size': stream.bytes_read,
+        'sha256': sha256.hexdigest()
+    }
+
+
+if __name__ == '__main__':
+    app.run()
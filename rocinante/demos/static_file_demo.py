@@ -6,13 +6,21 @@ app = Rocinante(__name__)
 app.add_static_file_handler(
     handler=StaticFileHandler,
     prefix='/images',
-    file_dir='images'
+    file_dir='images',
+    # keep up to 32 MB of files smaller than 64 KB in memory
+    memory_cache_size=32 * 1024 * 1024,
+    memory_cache_max_file_size=64 * 1024
 )
 
 app.add_static_file_handler(
     handler=StaticFileHandler,
     prefix='/videos',
-    file_dir='videos'
+    file_dir='videos',
+    # optional Cache-Control header of the files under this prefix
+    cache_control='public, max-age=3600',
+    # hash the files at startup, {{ static_url('/videos/intro.mp4') }} in templates or app.static_url()
+    # returns "/videos/intro.<hash>.mp4" which is served with an immutable Cache-Control
+    fingerprint=True
 )
 
 if __name__ == '__main__':
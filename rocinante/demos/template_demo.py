@@ -1,6 +1,11 @@
 from rocinante import Rocinante, Render, Request, RequestHeaders
 
-app = Rocinante(__name__)
+app = Rocinante(
+    __name__,
+    # keep compiled templates on disk and compile the ones in "templates" at startup
+    template_bytecode_cache_dir='.template_cache',
+    precompile_templates='templates'
+)
 
 
 @app.route('/')
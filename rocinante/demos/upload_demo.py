@@ -0,0 +1,24 @@
+from rocinante import Rocinante, UploadLimits, RequestFiles
+
+app = Rocinante(__name__)
+
+# bodies over 100MB get 413 before they are read, files over 1MB are spooled to /tmp/uploads
+upload_limits = UploadLimits(
+    max_content_length=100 * 1024 * 1024,
+    max_file_size=50 * 1024 * 1024,
+    memory_threshold=1024 * 1024,
+    upload_dir='/tmp/uploads'
+)
+
+
+@app.route('/upload', methods=['POST'], upload_limits=upload_limits)
+def upload(files: RequestFiles):
+    file = files['file']
+    file.save(f'/tmp/uploads/{file.filename}')
+    return {
+        'filename': file.filename
+    }
+
+
+if __name__ == '__main__':
+    app.run()
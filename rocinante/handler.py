@@ -1,6 +1,11 @@
+import gzip
 import os
 import traceback
+import uuid
+from datetime import datetime, timezone
 
+from werkzeug.http import http_date, is_resource_modified, parse_date, quote_etag, unquote_etag
+from werkzeug.wsgi import wrap_file
 from geventwebsocket import WebSocketError
 from geventwebsocket.resource import WebSocketApplication
 from geventwebsocket.websocket import WebSocket
@@ -8,7 +13,7 @@ from geventwebsocket.websocket import WebSocket
 from .application import Rocinante
 from .request import Request
 from .response import Response, JSONResponse, NotFoundResponse
-from .mime_type_mapping import MIME_TYPE_MAPPING
+from .mime_type_mapping import get_mime_type
 
 
 class RequestHandler(object):
@@ -38,56 +43,349 @@ class RequestHandler(object):
 
 
 class StaticFileHandler(RequestHandler):
+    # size of the chunks read when the server does not provide wsgi.file_wrapper
+    chunk_size = 64 * 1024
+
+    # requests asking for more ranges than this get the whole file
+    max_ranges = 16
+
+    # precompressed siblings in order of preference
+    precompressed_suffixes = (('br', '.br'), ('gzip', '.gz'))
+
+    # mimetypes compressed on the fly, smaller files are not worth it
+    compressible_mimetypes = (
+        'text/', 'application/json', 'application/javascript', 'application/xml', 'image/svg+xml'
+    )
+    compress_min_file_size = 512
+
+    # Cache-Control of fingerprinted urls, their content never changes
+    immutable_cache_control = 'public, max-age=31536000, immutable'
 
     def get(self, request: Request, filename: str):
+        prefix = '/' + request.path.split('/')[1]
 
-        filename_split = filename.split('.')
+        original_filename = self.application.static_file_options[prefix]['fingerprinted_files'].get(filename)
+        if original_filename is None:
+            return self._serve_file(request, filename, prefix)
 
-        if 2 <= len(filename_split) <= 3:
-            if len(filename_split) == 2:
-                image_type = filename_split[1]
-            else:
-                image_type = filename_split[1] + '.' + filename_split[2]
+        response = self._serve_file(request, original_filename, prefix)
 
-            if image_type not in MIME_TYPE_MAPPING.keys():
-                return JSONResponse(
-                    {
-                        'error': 'Unsupported file type.'
-                    }
-                )
+        # only responses about the file itself, not error responses
+        if 'ETag' in response.headers:
+            response.headers['Cache-Control'] = self.immutable_cache_control
 
-            handler_name = request.path.split('/')[1]
-            file_dir = self.application.static_file_handlers['/' + handler_name]
-            file_path = os.path.join(file_dir, filename)
+        return response
 
-            try:
-                with open(file_path, 'rb') as f:
-                    file = f.read()
-
-                return Response(
-                    file,
-                    mimetype=MIME_TYPE_MAPPING[image_type]
-                )
-
-            except FileNotFoundError:
-                return NotFoundResponse()
-
-            except:
-                traceback.print_exc()
-                return JSONResponse(
-                    {
-                        'error': 'Failed to read file.'
-                    },
-                    status=400
-                )
-
-        else:
+    def _serve_file(self, request: Request, filename: str, prefix: str):
+
+        if '.' not in filename:
             return JSONResponse(
                 {
                     'error': 'Invalid file name.'
                 }
             )
 
+        mimetype = get_mime_type(filename)
+        if mimetype is None:
+            return JSONResponse(
+                {
+                    'error': 'Unsupported file type.'
+                }
+            )
+
+        file_dir = self.application.static_file_handlers[prefix]
+        file_path = os.path.join(file_dir, filename)
+        options = self.application.static_file_options[prefix]
+        content_encoding = None
+
+        # encoded variants are only negotiated for whole file requests
+        if request.range is None:
+            if options['precompressed']:
+                precompressed_file = self._find_precompressed_file(request, file_path)
+                if precompressed_file is not None:
+                    file_path, content_encoding = precompressed_file
+
+            compressed_cache = options['compressed_cache']
+            if content_encoding is None and compressed_cache is not None \
+                    and mimetype.startswith(self.compressible_mimetypes) and request.accept_encodings['gzip']:
+                response = self._respond_compressed_file(request, compressed_cache, file_path, mimetype, prefix)
+                if response is not None:
+                    return response
+
+        # small hot files are served from memory, range requests always read the file
+        memory_cache = options['memory_cache']
+        if memory_cache is not None and request.range is None:
+            entry = memory_cache.get(file_path)
+            if entry is not None:
+                return self._respond_cached_file(request, entry, mimetype)
+
+        try:
+            file_stat = os.stat(file_path)
+
+            # answer revalidation from the stat data without opening the file
+            etag, last_modified, headers = self._make_validators(file_stat, prefix, content_encoding)
+            if not is_resource_modified(request.environ, etag, last_modified=last_modified):
+                return Response(status=304, headers=headers)
+
+            ranges = self._resolve_ranges(request, etag, last_modified, file_stat.st_size)
+            if ranges == []:
+                headers['Content-Range'] = f'bytes */{file_stat.st_size}'
+                return Response(status=416, headers=headers)
+
+            file = open(file_path, 'rb')
+
+        except FileNotFoundError:
+            return NotFoundResponse()
+
+        except:
+            traceback.print_exc()
+            return JSONResponse(
+                {
+                    'error': 'Failed to read file.'
+                },
+                status=400
+            )
+
+        if ranges is not None:
+            return self._stream_file_ranges(file, file_stat.st_size, ranges, mimetype, headers)
+
+        if memory_cache is not None and memory_cache.accept(file_stat.st_size):
+            return self._cache_file(memory_cache, file_path, file, mimetype, prefix, content_encoding)
+
+        return self._stream_file(request, file, mimetype, headers)
+
+    def _make_validators(self, file_stat: os.stat_result, prefix: str, content_encoding: str = None):
+        options = self.application.static_file_options[prefix]
+
+        etag = f'{file_stat.st_mtime_ns:x}-{file_stat.st_size:x}'
+        if content_encoding is not None:
+            etag += '-' + content_encoding
+        last_modified = datetime.fromtimestamp(file_stat.st_mtime, tz=timezone.utc)
+
+        headers = {
+            'ETag': quote_etag(etag),
+            'Last-Modified': http_date(last_modified),
+            'Accept-Ranges': 'bytes'
+        }
+
+        cache_control = options['cache_control']
+        if cache_control is not None:
+            headers['Cache-Control'] = cache_control
+
+        # the representation depends on Accept-Encoding as soon as encoded variants may be served
+        if options['precompressed'] or options['compressed_cache'] is not None:
+            headers['Vary'] = 'Accept-Encoding'
+
+        if content_encoding is not None:
+            headers['Content-Encoding'] = content_encoding
+
+        return etag, last_modified, headers
+
+    def _find_precompressed_file(self, request: Request, file_path: str):
+        accept_encodings = request.accept_encodings
+        for content_encoding, suffix in self.precompressed_suffixes:
+            if accept_encodings[content_encoding] and os.path.isfile(file_path + suffix):
+                return file_path + suffix, content_encoding
+
+    def _respond_compressed_file(self, request: Request, compressed_cache, file_path: str, mimetype: str, prefix: str):
+        """
+        gzip the file once and serve the cached bytes until the file changes, None lets the caller send it as is
+        """
+        entry = compressed_cache.get(file_path, 'gzip')
+        if entry is not None:
+            return self._respond_cached_file(request, entry, mimetype)
+
+        try:
+            file_stat = os.stat(file_path)
+        except OSError:
+            return None
+
+        if file_stat.st_size < self.compress_min_file_size or not compressed_cache.accept(file_stat.st_size):
+            return None
+
+        etag, last_modified, headers = self._make_validators(file_stat, prefix, 'gzip')
+        if not is_resource_modified(request.environ, etag, last_modified=last_modified):
+            return Response(status=304, headers=headers)
+
+        compressed_content, headers = self._read_into_cache(
+            compressed_cache,
+            file_path,
+            open(file_path, 'rb'),
+            prefix,
+            'gzip',
+            variant='gzip',
+            encode=lambda content: gzip.compress(content, mtime=0)
+        )
+
+        return Response(
+            compressed_content,
+            headers=headers,
+            mimetype=mimetype
+        )
+
+    @staticmethod
+    def _respond_cached_file(request: Request, entry: dict, mimetype: str):
+        if not is_resource_modified(request.environ, entry['etag'], last_modified=entry['last_modified']):
+            return Response(status=304, headers=entry['headers'])
+
+        return Response(
+            entry['content'],
+            headers=entry['headers'],
+            mimetype=mimetype
+        )
+
+    def _cache_file(self, memory_cache, file_path: str, file, mimetype: str, prefix: str,
+                    content_encoding: str = None):
+        content, headers = self._read_into_cache(memory_cache, file_path, file, prefix, content_encoding)
+
+        return Response(
+            content,
+            headers=headers,
+            mimetype=mimetype
+        )
+
+    def _read_into_cache(self, cache, file_path: str, file, prefix: str, content_encoding: str = None,
+                         variant: str = '', encode=None):
+        """
+        read and close the opened file, cache its content passed through encode, return (content, headers)
+        """
+        with file:
+            # the validators describe the opened file, not the path that may have been replaced since os.stat
+            file_stat = os.fstat(file.fileno())
+            content = file.read()
+
+        etag, last_modified, headers = self._make_validators(file_stat, prefix, content_encoding)
+        encoded_content = encode(content) if encode is not None else content
+
+        # a file written while it is read is served without caching
+        if len(content) == file_stat.st_size:
+            cache.set(
+                file_path,
+                file_stat,
+                encoded_content,
+                variant,
+                etag=etag,
+                last_modified=last_modified,
+                headers=headers
+            )
+
+        return encoded_content, headers
+
+    def _stream_file(self, request: Request, file, mimetype: str, headers: dict = None):
+        """
+        stream the opened file instead of reading it into memory, wsgi.file_wrapper lets the server use sendfile
+        """
+        try:
+            file_size = os.fstat(file.fileno()).st_size
+        except:
+            file.close()
+            raise
+
+        response = Response(
+            wrap_file(request.environ, file, self.chunk_size),
+            headers=headers,
+            mimetype=mimetype,
+            direct_passthrough=True
+        )
+        response.content_length = file_size
+        return response
+
+    def _resolve_ranges(self, request: Request, etag: str, last_modified: datetime, file_size: int):
+        """
+        return None to send the whole file, [] if no range is satisfiable, else a list of (start, stop)
+        """
+        request_range = request.range
+        if request_range is None or request_range.units != 'bytes' or len(request_range.ranges) > self.max_ranges:
+            return None
+
+        # If-Range only allows the partial response while the file is unchanged, werkzeug's IfRange drops "W/"
+        if_range = request.headers.get('If-Range')
+        if if_range is not None:
+            if_range = if_range.strip()
+            if if_range.startswith(('"', 'W/')):
+                # RFC 7233 3.2, strong comparison, a weak validator never matches
+                if_range_etag, weak = unquote_etag(if_range)
+                if weak or if_range_etag != etag:
+                    return None
+            else:
+                if_range_date = parse_date(if_range)
+                if if_range_date is None or last_modified.replace(microsecond=0) > if_range_date:
+                    return None
+
+        ranges = []
+        for start, stop in request_range.ranges:
+            # suffix range, "bytes=-500"
+            if start < 0:
+                start = max(file_size + start, 0)
+                stop = file_size
+            else:
+                stop = file_size if stop is None else min(stop, file_size)
+
+            if start < stop:
+                ranges.append((start, stop))
+
+        return ranges
+
+    def _stream_file_ranges(self, file, file_size: int, ranges: list, mimetype: str, headers: dict):
+        """
+        206 Partial Content, a single range is sent as is and several ranges as multipart/byteranges
+        """
+        if len(ranges) == 1:
+            start, stop = ranges[0]
+            headers['Content-Range'] = f'bytes {start}-{stop - 1}/{file_size}'
+
+            response = Response(
+                self._iter_file_parts(file, [(b'', start, stop)], b''),
+                status=206,
+                headers=headers,
+                mimetype=mimetype,
+                direct_passthrough=True
+            )
+            response.content_length = stop - start
+            return response
+
+        boundary = uuid.uuid4().hex
+        parts = []
+        for start, stop in ranges:
+            part_header = (
+                f'\r\n--{boundary}\r\n'
+                f'Content-Type: {mimetype}\r\n'
+                f'Content-Range: bytes {start}-{stop - 1}/{file_size}\r\n\r\n'
+            ).encode()
+            parts.append((part_header, start, stop))
+        closing = f'\r\n--{boundary}--\r\n'.encode()
+
+        response = Response(
+            self._iter_file_parts(file, parts, closing),
+            status=206,
+            headers=headers,
+            content_type=f'multipart/byteranges; boundary={boundary}',
+            direct_passthrough=True
+        )
+        response.content_length = sum(len(part_header) + stop - start for part_header, start, stop in parts) + len(
+            closing)
+        return response
+
+    def _iter_file_parts(self, file, parts: list, closing: bytes):
+        try:
+            for part_header, start, stop in parts:
+                if part_header:
+                    yield part_header
+
+                file.seek(start)
+                remaining = stop - start
+                while remaining > 0:
+                    chunk = file.read(min(self.chunk_size, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+
+            if closing:
+                yield closing
+        finally:
+            file.close()
+
 
 class WebsocketHandler(WebSocketApplication):
 
@@ -105,12 +403,14 @@ class WebsocketHandler(WebSocketApplication):
     def on_close(self, reason):
         pass
 
+    # the result is awaitable when the app is served by asgi_app and the handler is async,
+    # sync hooks of such a handler need not await it, their messages are sent once the hook returns
     def close(self, code: int = 1000, message: str = ''):
         message = message.encode()
-        self.ws.close(code, message)
+        return self.ws.close(code, message)
 
     def send(self, message):
-        self.ws.send(message)
+        return self.ws.send(message)
 
     def handle(self):
         self.protocol.on_open()
@@ -1,7 +1,16 @@
+import asyncio
+import traceback
+import zlib
+from io import BytesIO
+from threading import Lock, Thread
+from time import time
+
+import gevent
 from werkzeug import Response
 
 from .request import Request
 from .application import Rocinante
+from .cache import ResponseCache
 
 
 class Middleware(object):
@@ -29,3 +38,318 @@ class CORSMiddleware(Middleware):
             response.headers.add_header('Access-Control-Expose-Headers',
                                         'Access-Control-Allow-Origin,Access-Control-Allow-Credentials')
         return response
+
+
+class CompressionMiddleware(Middleware):
+    """
+    gzip/deflate responses negotiated on Accept-Encoding.
+    Buffered bodies smaller than minimum_size are sent as is, iterable bodies are compressed while they are sent
+    and flushed to the client every stream_flush_size input bytes, or sooner once stream_flush_interval seconds passed.
+    Already encoded and direct_passthrough responses (e.g. static files) are left alone.
+    """
+
+    compressible_mimetypes = {
+        'application/json',
+        'application/x-ndjson',
+        'application/javascript',
+        'application/xml',
+        'image/svg+xml'
+    }
+
+    # a sync flush ends the compressed block, flushing tiny chunks would barely compress them
+    stream_flush_size = 8 * 1024
+    # slow streams still reach the client in time
+    stream_flush_interval = 0.2
+
+    def __init__(
+            self,
+            application: Rocinante,
+            minimum_size: int = 500,
+            compress_level: int = 6,
+            mimetypes: set = None
+    ):
+        super().__init__(application)
+        self.minimum_size = minimum_size
+        self.compress_level = compress_level
+        if mimetypes is not None:
+            self.compressible_mimetypes = set(mimetypes)
+
+    def process_response(self, request: Request, response: Response):
+        if response.direct_passthrough or 'Content-Encoding' in response.headers:
+            return response
+
+        if response.status_code < 200 or response.status_code in (204, 206, 304):
+            return response
+
+        mimetype = response.mimetype
+        if mimetype is None or not (mimetype.startswith('text/') or mimetype in self.compressible_mimetypes):
+            return response
+
+        # the representation depends on Accept-Encoding from now on
+        response.vary.add('Accept-Encoding')
+
+        content_encoding = self._negotiate(request)
+        if content_encoding is None:
+            return response
+
+        if response.is_sequence:
+            data = response.get_data()
+            if len(data) < self.minimum_size:
+                return response
+            compressor = self._make_compressor(content_encoding)
+            response.set_data(compressor.compress(data) + compressor.flush())
+
+        else:
+            content_length = response.content_length
+            if content_length is not None and content_length < self.minimum_size:
+                return response
+            response.response = self._compress_stream(response.response, content_encoding)
+            del response.headers['Content-Length']
+
+        response.headers['Content-Encoding'] = content_encoding
+
+        # the compressed body is another representation
+        etag, weak = response.get_etag()
+        if etag is not None:
+            response.set_etag(f'{etag}-{content_encoding}', weak)
+
+        return response
+
+    @staticmethod
+    def _negotiate(request: Request):
+        accept_encodings = request.accept_encodings
+        gzip_quality = accept_encodings['gzip']
+        deflate_quality = accept_encodings['deflate']
+
+        if gzip_quality and gzip_quality >= deflate_quality:
+            return 'gzip'
+        if deflate_quality:
+            return 'deflate'
+        return None
+
+    def _make_compressor(self, content_encoding: str):
+        # gzip header for gzip, zlib header for http "deflate"
+        wbits = 16 + zlib.MAX_WBITS if content_encoding == 'gzip' else zlib.MAX_WBITS
+        return zlib.compressobj(self.compress_level, zlib.DEFLATED, wbits)
+
+    def _compress_stream(self, iterable, content_encoding: str):
+        compressor = self._make_compressor(content_encoding)
+        buffer = []
+        pending_size = 0
+        flushed_at = time()
+        try:
+            for chunk in iterable:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                if not chunk:
+                    continue
+                buffer.append(compressor.compress(chunk))
+                pending_size += len(chunk)
+
+                now = time()
+                if pending_size >= self.stream_flush_size or now - flushed_at >= self.stream_flush_interval:
+                    buffer.append(compressor.flush(zlib.Z_SYNC_FLUSH))
+                    yield b''.join(buffer)
+                    buffer = []
+                    pending_size = 0
+                    flushed_at = now
+            buffer.append(compressor.flush())
+            yield b''.join(buffer)
+        finally:
+            close = getattr(iterable, 'close', None)
+            if close is not None:
+                close()
+
+
+class ResponseCacheMiddleware(Middleware):
+    """
+    cache GET responses and answer GET/HEAD requests from the cache in process_request.
+    Entries are keyed by path, query string and the request headers named by the response's Vary header.
+    Responses with Cache-Control no-store/no-cache/private, Set-Cookie, Vary: * or a streamed body are not cached.
+    Responses to requests with Authorization are only cached, and served to them, when they are public or s-maxage,
+    responses to requests with Cookie only when they vary on Cookie.
+    The ttl is the response's s-maxage/max-age, else the longest matching prefix of route_ttls, else default_ttl.
+    For stale_while_revalidate seconds after expiring, an entry is still served while it is refreshed in background.
+    Cached responses are replayed with all their headers and skip process_response of the other middlewares.
+    """
+
+    # marks the environ of background refresh requests
+    refresh_environ_key = 'rocinante.response_cache.refresh'
+
+    def __init__(
+            self,
+            application: Rocinante,
+            max_bytes: int = 64 * 1024 * 1024,
+            max_entry_size: int = 1024 * 1024,
+            default_ttl: float = 60,
+            route_ttls: dict = None,
+            stale_while_revalidate: float = 0
+    ):
+        super().__init__(application)
+        self.cache = ResponseCache(max_bytes, max_entry_size)
+        self.default_ttl = default_ttl
+        # longest prefix first
+        self.route_ttls = sorted((route_ttls or {}).items(), key=lambda item: len(item[0]), reverse=True)
+        self.stale_while_revalidate = stale_while_revalidate
+        self._refreshing = set()
+        self._refreshing_lock = Lock()
+        # the event loop only keeps weak references to tasks
+        self._refresh_tasks = set()
+
+    def process_request(self, request: Request):
+        if request.method not in ('GET', 'HEAD') or self._is_refresh(request.environ):
+            return None
+
+        if request.cache_control.no_cache or request.cache_control.no_store:
+            return None
+
+        key = self.cache.make_key(request.path, request.query_string, request.headers)
+        entry = self.cache.get(key)
+        if entry is None or not self._is_shareable(request, entry['shared'], entry['vary']):
+            return None
+
+        now = time()
+        if now >= entry['expires_at']:
+            if now >= entry['expires_at'] + self.stale_while_revalidate:
+                return None
+            self._refresh(key, request.environ)
+
+        response = Response(entry['body'], entry['status'], entry['headers'])
+        response.age = int(now - entry['created_at'])
+        return response
+
+    def process_response(self, request: Request, response: Response):
+        if request.method != 'GET' or response.status_code != 200:
+            return response
+
+        if response.direct_passthrough or not response.is_sequence:
+            return response
+
+        cache_control = response.cache_control
+        if cache_control.no_store or cache_control.no_cache or cache_control.private:
+            return response
+
+        if 'Set-Cookie' in response.headers or '*' in response.vary:
+            return response
+
+        # a shared cache must not hand one user's response to another
+        shared = cache_control.public or cache_control.s_maxage is not None
+        vary = tuple(sorted(name.lower() for name in response.vary))
+        if not self._is_shareable(request, shared, vary):
+            return response
+
+        ttl = self._get_ttl(request.path, cache_control)
+        if ttl <= 0:
+            return response
+
+        now = time()
+        self.cache.set(
+            request.path,
+            request.query_string,
+            request.headers,
+            vary,
+            {
+                'body': response.get_data(),
+                'status': response.status,
+                'headers': list(response.headers.items()),
+                'shared': shared,
+                'vary': vary,
+                'created_at': now,
+                'expires_at': now + ttl
+            }
+        )
+        return response
+
+    @staticmethod
+    def _is_shareable(request: Request, shared: bool, vary: tuple):
+        """
+        RFC 9111 3.5, responses to authorized requests are stored only when marked public or s-maxage,
+        responses to requests with cookies only when they are keyed by the cookies
+        """
+        if 'Authorization' in request.headers and not shared:
+            return False
+        if 'Cookie' in request.headers and 'cookie' not in vary:
+            return False
+        return True
+
+    def _get_ttl(self, path: str, cache_control):
+        max_age = cache_control.s_maxage if cache_control.s_maxage is not None else cache_control.max_age
+        if max_age is not None:
+            return max_age
+
+        for prefix, ttl in self.route_ttls:
+            if path.startswith(prefix):
+                return ttl
+
+        return self.default_ttl
+
+    def _refresh(self, key: tuple, environ: dict):
+        # refresh each entry once at a time
+        with self._refreshing_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        # refresh through the entry point that served the request, async views only run under asgi_app
+        loop = self._get_running_loop() if 'asgi.scope' in environ else None
+        if loop is not None:
+            task = loop.create_task(self._refresh_asgi(key, environ['asgi.scope']))
+            self._refresh_tasks.add(task)
+            task.add_done_callback(self._refresh_tasks.discard)
+            return
+
+        environ = dict(environ)
+        environ['wsgi.input'] = BytesIO()
+        environ['REQUEST_METHOD'] = 'GET'
+        environ[self.refresh_environ_key] = True
+
+        def refresh():
+            try:
+                app_iter = self.application.wsgi_app(environ, lambda status, headers, exc_info=None: None)
+                try:
+                    for _ in app_iter:
+                        pass
+                finally:
+                    close = getattr(app_iter, 'close', None)
+                    if close is not None:
+                        close()
+            except Exception:
+                traceback.print_exc()
+            finally:
+                with self._refreshing_lock:
+                    self._refreshing.discard(key)
+
+        # a greenlet under gevent's server, a thread otherwise
+        if environ.get('SERVER_SOFTWARE', '').startswith('gevent'):
+            gevent.spawn(refresh)
+        else:
+            Thread(target=refresh, daemon=True).start()
+
+    async def _refresh_asgi(self, key: tuple, scope: dict):
+        scope = dict(scope, method='GET')
+        scope[self.refresh_environ_key] = True
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            pass
+
+        try:
+            await self.application.asgi_app(scope, receive, send)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            with self._refreshing_lock:
+                self._refreshing.discard(key)
+
+    def _is_refresh(self, environ: dict):
+        return bool(environ.get(self.refresh_environ_key) or environ.get('asgi.scope', {}).get(self.refresh_environ_key))
+
+    @staticmethod
+    def _get_running_loop():
+        # e.g. the app served by a wsgi server through a2wsgi also has an asgi scope, but no loop in its thread
+        try:
+            return asyncio.get_running_loop()
+        except RuntimeError:
+            return None
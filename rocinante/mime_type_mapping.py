@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 MIME_TYPE_MAPPING = {
     "123": "application/vnd.lotus-1-2-3",
     "3ds": "image/x-3ds",
@@ -685,3 +687,65 @@ MIME_TYPE_MAPPING = {
     "zabw": "application/x-abiword",
     "zip": "application/zip"
 }
+
+
+def _expand_pattern(pattern: str):
+    """
+    expand the character classes of a glob style key, "anim[1-9j]" -> ["anim1", ..., "anim9", "animj"]
+    """
+    start = pattern.find('[')
+    if start == -1:
+        return [pattern]
+
+    end = pattern.index(']', start)
+    characters = []
+    character_class = pattern[start + 1:end]
+    index = 0
+    while index < len(character_class):
+        if index + 2 < len(character_class) and character_class[index + 1] == '-':
+            first, last = ord(character_class[index]), ord(character_class[index + 2])
+            characters.extend(chr(code) for code in range(first, last + 1))
+            index += 3
+        else:
+            characters.append(character_class[index])
+            index += 1
+
+    return [
+        expanded for character in characters for expanded in
+        _expand_pattern(pattern[:start] + character + pattern[end + 1:])
+    ]
+
+
+# lowercased suffix -> mime type, compiled once at import time
+MIME_TYPE_SUFFIX_INDEX = {
+    expanded.lower(): mime_type for key, mime_type in MIME_TYPE_MAPPING.items() for expanded in _expand_pattern(key)
+}
+
+# the longest suffix has this many dot separated parts, e.g. "abw.crashed"
+MIME_TYPE_MAX_SUFFIX_PARTS = max(suffix.count('.') + 1 for suffix in MIME_TYPE_SUFFIX_INDEX)
+
+
+@lru_cache(maxsize=1024)
+def _get_mime_type_by_suffix(suffix: str):
+    # try "min.js", then "js"
+    while True:
+        mime_type = MIME_TYPE_SUFFIX_INDEX.get(suffix)
+        if mime_type is not None:
+            return mime_type
+
+        dot = suffix.find('.')
+        if dot == -1:
+            return None
+        suffix = suffix[dot + 1:]
+
+
+def get_mime_type(filename: str):
+    """
+    resolve the mime type of filename by its longest known suffix, "app.v2.min.js" -> "application/javascript"
+    return None if filename has no suffix or no known suffix
+    """
+    parts = filename.lower().split('.')
+    if len(parts) < 2:
+        return None
+
+    return _get_mime_type_by_suffix('.'.join(parts[1:][-MIME_TYPE_MAX_SUFFIX_PARTS:]))
@@ -0,0 +1,66 @@
+from typing import AnyStr, Callable
+
+
+class _MountNode(object):
+    __slots__ = ('children', 'path', 'app')
+
+    def __init__(self):
+        self.children = {}
+        self.path = None
+        self.app = None
+
+
+class MountedAppTrie(object):
+    """
+    Prefix trie of mounted applications keyed by path segments.
+    "/flask" matches "/flask" and "/flask/index" but not "/flask2", the longest mounted prefix wins.
+    """
+
+    def __init__(self):
+        self.root = _MountNode()
+        self.paths = {}
+
+    @staticmethod
+    def _split(path: AnyStr):
+        return [segment for segment in path.split('/') if segment]
+
+    def insert(self, path: AnyStr, app: Callable):
+        node = self.root
+        for segment in self._split(path):
+            child = node.children.get(segment)
+            if child is None:
+                child = node.children[segment] = _MountNode()
+            node = child
+        node.path = path
+        node.app = app
+        self.paths[path] = app
+
+    def match(self, path: AnyStr):
+        """
+        return (mounted path, app) of the longest mounted prefix of path, or None
+        """
+        node = self.root
+        matched = None
+
+        if node.app is not None:
+            matched = node
+
+        for segment in self._split(path):
+            node = node.children.get(segment)
+            if node is None:
+                break
+            if node.app is not None:
+                matched = node
+
+        if matched is None:
+            return None
+        return matched.path, matched.app
+
+    def __contains__(self, path: AnyStr):
+        return path in self.paths
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __bool__(self):
+        return bool(self.paths)
@@ -1,13 +1,184 @@
-import json
-import traceback
+import os
+from tempfile import SpooledTemporaryFile
 
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
 from werkzeug.wrappers import Request as _Request
 
+from .codec import default_json_codec
+
+
+class InvalidRequestJSON(BadRequest):
+    description = 'Invalid JSON body.'
+
+
+class RequestJSONTooLarge(RequestEntityTooLarge):
+    description = 'JSON body is too large.'
+
+
+class UploadTooLarge(RequestEntityTooLarge):
+    description = 'Upload is too large.'
+
+
+class UploadLimits(object):
+    """
+    Per route upload settings, e.g. app.route('/upload', methods=['POST'], upload_limits=UploadLimits(...)).
+    max_content_length rejects larger bodies with 413, from the Content-Length header before the body is read
+    max_file_size rejects a single uploaded file larger than this many bytes with 413
+    max_form_memory_size limits the non file fields of a multipart body kept in memory
+    memory_threshold is the size up to which an uploaded file stays in memory before it is spooled to upload_dir
+    upload_dir is the directory of the spooled files, the system temp dir by default
+    None means no limit.
+    """
+
+    def __init__(
+            self,
+            max_content_length: int = None,
+            max_file_size: int = None,
+            max_form_memory_size: int = None,
+            memory_threshold: int = 500 * 1024,
+            upload_dir: str = None
+    ):
+        self.max_content_length = max_content_length
+        self.max_file_size = max_file_size
+        self.max_form_memory_size = max_form_memory_size
+        self.memory_threshold = memory_threshold
+        self.upload_dir = upload_dir
+
+        if upload_dir is not None:
+            os.makedirs(upload_dir, exist_ok=True)
+
+    def make_file_stream(self):
+        return _SpooledUploadFile(
+            self.max_file_size,
+            max_size=self.memory_threshold,
+            mode='rb+',
+            dir=self.upload_dir
+        )
+
+
+class _SpooledUploadFile(SpooledTemporaryFile):
+    """
+    spooled to disk past the memory threshold, writing more than max_file_size raises UploadTooLarge
+    """
+
+    def __init__(self, max_file_size: int = None, **kwargs):
+        super().__init__(**kwargs)
+        self._max_file_size = max_file_size
+        self._written = 0
+
+    def write(self, s):
+        self._written += len(s)
+        if self._max_file_size is not None and self._written > self._max_file_size:
+            raise UploadTooLarge()
+        return super().write(s)
+
+
+class BoundedStream(object):
+    """
+    read at most max_size bytes of stream, reading past them raises UploadTooLarge
+    """
+
+    def __init__(self, stream, max_size: int):
+        self._stream = stream
+        self._max_size = max_size
+        self._read = 0
+
+    def _check(self, data: bytes):
+        self._read += len(data)
+        if self._read > self._max_size:
+            raise UploadTooLarge()
+        return data
+
+    def _limit(self, size: int):
+        # one byte more than allowed is enough to detect an oversized body
+        remaining = self._max_size - self._read + 1
+        if size is None or size < 0:
+            return remaining
+        return min(size, remaining)
+
+    def read(self, size: int = -1):
+        return self._check(self._stream.read(self._limit(size)))
+
+    def readline(self, size: int = -1):
+        return self._check(self._stream.readline(self._limit(size)))
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            yield line
+
+
+class RequestBodyStream(object):
+    """
+    Chunk iterable reader of the request body, the body is never held in memory as a whole.
+    Bounded by Content-Length, chunked bodies by the max_content_length of the route.
+    """
+
+    def __init__(self, stream, chunk_size: int = 64 * 1024):
+        self._stream = stream
+        self.chunk_size = chunk_size
+        self.bytes_read = 0
+
+    def read(self, size: int = -1):
+        data = self._stream.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
 
 class Request(_Request):
+    # replaced by the json settings of the application that handles the request
+    json_codec = default_json_codec
+
+    # maximum size of a json body in bytes, None means no limit
+    json_max_size = None
+
+    # set per request from the upload_limits of the matched route
+    upload_limits = None
+
+    # size of the chunks yielded by iterating body_stream
+    body_stream_chunk_size = 64 * 1024
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.user = None
+        self._parsed_json = None
+        self._body_stream = None
+
+    def set_upload_limits(self, upload_limits: UploadLimits):
+        """
+        apply the upload limits of the matched route, announced oversized bodies raise UploadTooLarge (413) unread
+        """
+        self.upload_limits = upload_limits
+
+        if upload_limits.max_form_memory_size is not None:
+            self.max_form_memory_size = upload_limits.max_form_memory_size
+
+        max_content_length = upload_limits.max_content_length
+        if max_content_length is None:
+            return
+
+        self.max_content_length = max_content_length
+        content_length = self.content_length
+        if content_length is not None and content_length > max_content_length:
+            raise UploadTooLarge()
+
+        # chunked bodies announce no size, count the bytes while they are read
+        if content_length is None and self.environ.get('wsgi.input_terminated'):
+            self.__dict__['stream'] = BoundedStream(self.environ['wsgi.input'], max_content_length)
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.upload_limits is None:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        return self.upload_limits.make_file_stream()
 
     def set_current_user(self, user):
         self.user = user
@@ -21,20 +192,51 @@ class Request(_Request):
         return self.headers.get('Origin', None)
 
     def _get_json(self):
-        body = self.data
-        if body:
-            try:
-                decode_body = body.decode()
-                json_data = json.loads(decode_body)
-                if not isinstance(json_data, dict):
-                    json_data = {}
-            except:
-                traceback.print_exc()
-                json_data = {}
-        else:
+        # refuse before reading the body when the client announces its size
+        if self.json_max_size is not None and (self.content_length or 0) > self.json_max_size:
+            raise RequestJSONTooLarge()
+
+        body = getattr(self, '_cached_data', None)
+        if body is None:
+            if self.json_max_size is None:
+                body = self.data
+            else:
+                # a chunked body announces no size, read at most one byte past the limit
+                body = self.stream.read(self.json_max_size + 1)
+                if len(body) > self.json_max_size:
+                    raise RequestJSONTooLarge()
+                # cached like request.data
+                self._cached_data = body
+        elif self.json_max_size is not None and len(body) > self.json_max_size:
+            raise RequestJSONTooLarge()
+
+        if not body:
+            return {}
+
+        try:
+            # parse straight from bytes
+            json_data = self.json_codec.loads(body)
+        except Exception:
+            raise InvalidRequestJSON()
+
+        if not isinstance(json_data, dict):
             json_data = {}
         return json_data
 
+    @property
+    def body_stream(self):
+        """
+        read the body incrementally instead of request.data, it can only be consumed once
+        """
+        if self._body_stream is None:
+            self._body_stream = RequestBodyStream(self.stream, self.body_stream_chunk_size)
+        return self._body_stream
+
     @property
     def json(self):
-        return self._get_json()
+        """
+        parsed once on first access, malformed bodies raise InvalidRequestJSON (400)
+        """
+        if self._parsed_json is None:
+            self._parsed_json = self._get_json()
+        return self._parsed_json
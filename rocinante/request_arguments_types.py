@@ -1,6 +1,6 @@
 from werkzeug.datastructures import EnvironHeaders, ImmutableMultiDict
 
-from .request import Request
+from .request import Request, RequestBodyStream
 
 
 class RequestHeaders(EnvironHeaders):
@@ -31,6 +31,10 @@ class RequestBody(bytes):
     pass
 
 
+class RequestStream(RequestBodyStream):
+    pass
+
+
 SUPPORT_ARGUMENTS_MAPPING = {
     Request: 'request',
     RequestHeaders: 'headers',
@@ -39,5 +43,6 @@ SUPPORT_ARGUMENTS_MAPPING = {
     RequestFiles: 'files',
     RequestArgs: 'args',
     RequestJSON: 'json',
-    RequestBody: 'data'
+    RequestBody: 'data',
+    RequestStream: 'body_stream'
 }
@@ -1,9 +1,11 @@
-import json
-
 from werkzeug.wrappers import Response
 
+from .codec import default_json_codec
+
 
 class JSONResponse(Response):
+    json_codec = default_json_codec
+
     def __init__(
             self,
             response=None,
@@ -13,7 +15,39 @@ class JSONResponse(Response):
             content_type=None,
             direct_passthrough=False,
     ):
-        response = json.dumps(response)
+        response = self.json_codec.dumps(response)
+        super().__init__(
+            response,
+            status,
+            headers,
+            mimetype,
+            content_type,
+            direct_passthrough
+        )
+
+
+class StreamingJSONResponse(Response):
+    """
+    encode the items of an iterable one by one as a json array, or as newline delimited json with ndjson=True
+    """
+    json_codec = default_json_codec
+
+    # encoded items are sent in chunks of about this many bytes
+    buffer_size = 16 * 1024
+
+    def __init__(
+            self,
+            response=None,
+            status=None,
+            headers=None,
+            mimetype=None,
+            content_type=None,
+            direct_passthrough=False,
+            ndjson=False
+    ):
+        if mimetype is None:
+            mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+        response = self._iter_json(response if response is not None else (), ndjson)
         super().__init__(
             response,
             status,
@@ -23,6 +57,45 @@ class JSONResponse(Response):
             direct_passthrough
         )
 
+    def _iter_json(self, iterable, ndjson):
+        dumps = self.json_codec.dumps
+        buffer_size = self.buffer_size
+        separator = b'\n' if ndjson else b','
+
+        buffer = [] if ndjson else [b'[']
+        buffered = 0
+        first = True
+
+        try:
+            for item in iterable:
+                data = dumps(item)
+                if ndjson:
+                    buffer.append(data)
+                    buffer.append(separator)
+                elif first:
+                    buffer.append(data)
+                else:
+                    buffer.append(separator)
+                    buffer.append(data)
+                first = False
+
+                buffered += len(data) + 1
+                if buffered >= buffer_size:
+                    yield b''.join(buffer)
+                    buffer = []
+                    buffered = 0
+
+            if not ndjson:
+                buffer.append(b']')
+            if buffer:
+                yield b''.join(buffer)
+
+        finally:
+            # release the source, e.g. a database cursor, when the client goes away
+            close = getattr(iterable, 'close', None)
+            if close is not None:
+                close()
+
 
 class NotFoundResponse(Response):
     def __init__(
@@ -65,6 +138,14 @@ class MethodNotAllowedResponse(Response):
 
 
 class Render(object):
+    """
+    stream=True sends the page while jinja renders it instead of building the whole string first,
+    buffer_size then joins the rendered pieces into chunks of at least this many characters.
+    render_cache and render_cache_key are set by rocinante.decorator.cache_render, cached pages are never streamed.
+    """
+    render_cache = None
+
+    render_cache_key = None
 
     def __init__(self,
                  template_path,
@@ -74,6 +155,8 @@ class Render(object):
                  content_type=None,
                  direct_passthrough=None,
                  application=None,
+                 stream=False,
+                 buffer_size=None,
                  **context
                  ):
         self.template_path = template_path
@@ -82,14 +165,23 @@ class Render(object):
         self.mimetype = mimetype
         self.content_type = content_type
         self.direct_passthrough = direct_passthrough
+        self.stream = stream
+        self.buffer_size = buffer_size
         self.context = context
 
         if application is not None:
             template_environment = application.template_environment
 
+            if self.render_cache is not None:
+                self.html_content = self._render_cached(template_environment)
+                return
+
             template = template_environment.get_template(template_path)
 
-            self.html_content = template.render(**context)
+            if stream:
+                self.html_content = self._generate(template, context, buffer_size)
+            else:
+                self.html_content = template.render(**context)
 
     def reload_render(self, application):
         self.__init__(
@@ -100,6 +192,8 @@ class Render(object):
             self.content_type,
             self.direct_passthrough,
             application,
+            stream=self.stream,
+            buffer_size=self.buffer_size,
             **self.context
         )
 
@@ -112,3 +206,32 @@ class Render(object):
             self.content_type,
             self.direct_passthrough
         )
+
+    def _render_cached(self, template_environment):
+        key = (self.template_path, self.render_cache_key(self.context))
+
+        html_content = self.render_cache.get(key)
+        if html_content is None:
+            html_content = template_environment.get_template(self.template_path).render(**self.context)
+            self.render_cache.set(key, html_content)
+
+        return html_content
+
+    @staticmethod
+    def _generate(template, context, buffer_size):
+        if not buffer_size:
+            yield from template.generate(**context)
+            return
+
+        buffer = []
+        buffered = 0
+        for piece in template.generate(**context):
+            buffer.append(piece)
+            buffered += len(piece)
+            if buffered >= buffer_size:
+                yield ''.join(buffer)
+                buffer = []
+                buffered = 0
+
+        if buffer:
+            yield ''.join(buffer)
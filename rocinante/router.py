@@ -2,6 +2,7 @@ from typing import List, Type
 
 from geventwebsocket import WebSocketApplication
 from werkzeug.routing import Rule
+from .request import UploadLimits
 from .url import Url
 
 
@@ -12,18 +13,24 @@ class Router(object):
         self.rules = []
         self.websocket_rules = []
 
-    def route(self, rule, *, methods=['GET']):
+    def route(self, rule, *, methods=['GET'], upload_limits: UploadLimits = None):
         self._check_methods(methods)
 
         def wrapper(fbv):
             fbv.allow_methods = methods
-            self.rules.append(Rule(rule, endpoint=fbv))
+            self.rules.append(self._make_rule(rule, fbv, upload_limits))
             return fbv
 
         return wrapper
 
-    def add_handler(self, rule, handler):
-        self.rules.append(Rule(rule, endpoint=handler))
+    def add_handler(self, rule, handler, *, upload_limits: UploadLimits = None):
+        self.rules.append(self._make_rule(rule, handler, upload_limits))
+
+    @staticmethod
+    def _make_rule(rule: str, endpoint, upload_limits: UploadLimits = None):
+        rule = Rule(rule, endpoint=endpoint)
+        rule.upload_limits = upload_limits
+        return rule
 
     def _check_methods(self, methods):
         for method in methods:
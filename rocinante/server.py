@@ -0,0 +1,296 @@
+import os
+import random
+import signal
+import socket
+import sys
+import time
+import traceback
+
+import gevent
+from gevent.lock import Semaphore
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+from geventwebsocket.handler import WebSocketHandler as GeventWebSocketHandler
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.wsgi import ClosingIterator
+
+
+class AdmissionControl(object):
+    """
+    Run at most max_active_requests requests of the application at once, up to max_queued_requests more wait for a slot.
+    Requests beyond the queue, or waiting longer than queue_timeout seconds, get 503 with Retry-After right away,
+    so overload sheds requests instead of piling up greenlets. Websocket connections are not counted.
+    """
+
+    def __init__(
+            self,
+            application,
+            max_active_requests: int,
+            max_queued_requests: int = 0,
+            queue_timeout: float = None,
+            retry_after: int = 1
+    ):
+        self.application = application
+        self.max_active_requests = max_active_requests
+        self.max_queued_requests = max_queued_requests
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+
+        self.queued_requests = 0
+        self.rejected_requests = 0
+        self._semaphore = Semaphore(max_active_requests)
+
+    def __call__(self, environ: dict, start_response):
+        # a websocket lives as long as its connection and geventwebsocket never closes its result, let it through
+        if 'wsgi.websocket' in environ:
+            return self.application(environ, start_response)
+
+        if self._semaphore.locked():
+            if self.queued_requests >= self.max_queued_requests:
+                return self._reject(environ, start_response)
+
+            self.queued_requests += 1
+            try:
+                acquired = self._semaphore.acquire(timeout=self.queue_timeout)
+            finally:
+                self.queued_requests -= 1
+
+            if not acquired:
+                return self._reject(environ, start_response)
+        else:
+            self._semaphore.acquire()
+
+        try:
+            response = self.application(environ, start_response)
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+        # streamed responses hold their slot until the server closes them
+        return ClosingIterator(response, self._semaphore.release)
+
+    def _reject(self, environ: dict, start_response):
+        self.rejected_requests += 1
+        response = self.application._make_http_exception_response(ServiceUnavailable())
+        response.headers['Retry-After'] = str(self.retry_after)
+        return response(environ, start_response)
+
+
+class PreforkServer(object):
+    """
+    Fork workers that serve the application with gevent, the master restarts workers that exit.
+    reuse_port gives every worker its own SO_REUSEPORT socket and lets the kernel balance connections,
+    otherwise the workers share the socket the master bound before forking.
+    max_requests recycles a worker after it handled about that many requests, 0 means never.
+    max_active_requests, max_queued_requests and queue_timeout shed load of every worker, see AdmissionControl.
+    SIGTERM/SIGINT stop the workers gracefully and exit, SIGHUP restarts them.
+    """
+
+    # a worker exiting sooner than this is crashing, wait before forking it again
+    min_worker_lifetime = 1.0
+
+    # seconds in flight requests get to finish when a worker stops
+    graceful_timeout = 30
+
+    def __init__(
+            self,
+            application,
+            host: str = '0.0.0.0',
+            port: int = 8000,
+            *,
+            workers: int = None,
+            worker_connections: int = 1000,
+            max_active_requests: int = None,
+            max_queued_requests: int = 0,
+            queue_timeout: float = None,
+            retry_after: int = 1,
+            max_requests: int = 0,
+            max_requests_jitter: int = 0,
+            reuse_port: bool = False,
+            backlog: int = 2048
+    ):
+        if not hasattr(os, 'fork'):
+            raise Exception('Prefork server requires os.fork.')
+
+        if reuse_port and not hasattr(socket, 'SO_REUSEPORT'):
+            raise Exception('SO_REUSEPORT is not supported on this platform.')
+
+        self.application = application
+        self.host = host
+        self.port = port
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        self.worker_connections = worker_connections
+        self.max_active_requests = max_active_requests
+        self.max_queued_requests = max_queued_requests
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.reuse_port = reuse_port
+        self.backlog = backlog
+
+        # pid to start time of the running workers
+        self.worker_pids = {}
+        self.listener = None
+        self._stopping = False
+
+        # the gevent server of this process once it is a worker
+        self._server = None
+
+    def serve_forever(self):
+        # fail in the master if the address cannot be bound, not in every worker
+        self.listener = self._create_socket()
+        if self.reuse_port:
+            self.listener.close()
+            self.listener = None
+        else:
+            self.listener.listen(self.backlog)
+
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_restart)
+
+        print(f'Prefork server listening on {self.host}:{self.port} with {self.workers} workers.')
+
+        for _ in range(self.workers):
+            self._spawn_worker()
+
+        while self.worker_pids:
+            try:
+                pid, _ = os.wait()
+            except ChildProcessError:
+                break
+
+            started_at = self.worker_pids.pop(pid, None)
+            if started_at is None or self._stopping:
+                continue
+
+            if time.monotonic() - started_at < self.min_worker_lifetime:
+                time.sleep(self.min_worker_lifetime)
+
+            # a stop signal may have arrived while sleeping
+            if not self._stopping:
+                self._spawn_worker()
+
+        if self.listener is not None:
+            self.listener.close()
+
+    def _handle_stop(self, signum, frame):
+        self._stopping = True
+        self._signal_workers(signal.SIGTERM)
+
+    def _handle_restart(self, signum, frame):
+        # the workers stop gracefully and the master forks new ones
+        self._signal_workers(signal.SIGTERM)
+
+    def _signal_workers(self, signum: int):
+        for pid in list(self.worker_pids):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _create_socket(self):
+        family = socket.AF_INET6 if ':' in self.host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((self.host, self.port))
+        return sock
+
+    def _spawn_worker(self):
+        pid = os.fork()
+
+        if pid == 0:
+            status = 0
+            try:
+                self._run_worker()
+            except BaseException:
+                traceback.print_exc()
+                status = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(status)
+
+        self.worker_pids[pid] = time.monotonic()
+
+    def _run_worker(self):
+        # the master handlers must not run in the worker
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+        gevent.reinit()
+
+        if self.reuse_port:
+            listener = self._create_socket()
+            listener.listen(self.backlog)
+        else:
+            listener = self.listener
+
+        # gevent waits for connections itself, accept must not block the hub
+        listener.setblocking(False)
+
+        # e.g. database connections, which must not be shared between processes
+        self.application.run_worker_startup_events()
+
+        server = WSGIServer(
+            listener,
+            self._make_worker_application(),
+            handler_class=GeventWebSocketHandler,
+            spawn=Pool(self.worker_connections)
+        )
+        self._server = server
+
+        gevent.signal_handler(signal.SIGTERM, self._stop_worker)
+        gevent.signal_handler(signal.SIGINT, self._stop_worker)
+
+        server.serve_forever(stop_timeout=self.graceful_timeout)
+
+    def _stop_worker(self):
+        # stop accepting, serve_forever waits for the requests in flight
+        if not self._server.closed:
+            self._server.close()
+
+    def _make_worker_application(self):
+        application = self.application
+        if self.max_active_requests is not None:
+            application = AdmissionControl(
+                application,
+                self.max_active_requests,
+                self.max_queued_requests,
+                self.queue_timeout,
+                self.retry_after
+            )
+
+        max_requests = self.max_requests
+        if max_requests:
+            # workers started together should not all restart together
+            max_requests += random.randint(0, self.max_requests_jitter)
+
+        handled_requests = 0
+
+        def worker_application(environ, start_response):
+            nonlocal handled_requests
+            handled_requests += 1
+
+            if max_requests and handled_requests >= max_requests:
+                self._stop_worker()
+
+            # keep-alive clients of a stopping worker reconnect to a live one
+            if self._server.closed and 'HTTP_UPGRADE' not in environ:
+                return application(environ, _close_connection(start_response))
+
+            return application(environ, start_response)
+
+        return worker_application
+
+
+def _close_connection(start_response):
+    def wrapper(status, headers, exc_info=None):
+        headers = [(key, value) for key, value in headers if key.lower() != 'connection']
+        headers.append(('Connection', 'close'))
+        return start_response(status, headers, exc_info)
+
+    return wrapper
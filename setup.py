@@ -14,5 +14,8 @@ setuptools.setup(
         "gevent-websocket",
         "a2wsgi",
         "Jinja2"
-    ]
+    ],
+    extras_require={
+        "orjson": ["orjson"]
+    }
 )